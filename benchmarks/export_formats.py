@@ -0,0 +1,52 @@
+"""Compare write speed and output size of the export formats.
+
+Run from the repository root:
+
+    python -m benchmarks.export_formats [rows]
+
+Synthetic user rows are streamed through ``export_parts`` for each format,
+the same path the admin export jobs use.
+"""
+import asyncio
+import sys
+import time
+from datetime import datetime, timedelta
+
+from utils.export_writers import USERS_TABLE, EXPORT_FORMATS, export_parts
+
+
+def fake_users(count):
+    start = datetime(2025, 1, 1)
+    for i in range(count):
+        yield {
+            'telegram_id': 5_000_000_000 + i,
+            'full_name': f"Foydalanuvchi {i}",
+            'phone_number': f"+99890{i % 10_000_000:07d}",
+            'registered_at': start + timedelta(seconds=i),
+            'promocode_count': i % 17,
+        }
+
+
+async def bench(fmt, rows):
+    started = time.perf_counter()
+    parts = 0
+    size = 0
+    async for part in export_parts(USERS_TABLE, fake_users(rows), fmt):
+        parts += 1
+        size += len(part.data)
+    elapsed = time.perf_counter() - started
+    return elapsed, size, parts
+
+
+async def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    print(f"{rows} rows")
+    print(f"{'format':<10}{'seconds':>10}{'rows/s':>12}{'MB':>10}{'bytes/row':>11}{'parts':>7}")
+    for fmt in EXPORT_FORMATS:
+        elapsed, size, parts = await bench(fmt, rows)
+        print(f"{fmt:<10}{elapsed:>10.2f}{rows / elapsed:>12.0f}"
+              f"{size / 1024 / 1024:>10.2f}{size / rows:>11.1f}{parts:>7}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,88 @@
+"""Compare FSM storage memory of MemoryStorage and BoundedMemoryStorage.
+
+Run from the repository root:
+
+    python -m benchmarks.fsm_storage_memory [users]
+
+Each storage runs in a fresh interpreter. Every simulated user goes through
+the registration flow of handlers/user_handlers.py: /start, the name (kept in
+FSM data), then either the phone number (state main_menu, data cleared) or
+nothing, for the ABANDONED share of users. Reported is the RSS growth of the
+process and the estimate of BoundedMemoryStorage.memory_usage().
+"""
+import asyncio
+import subprocess
+import sys
+import time
+
+USERS = 1_000_000
+ABANDONED = 0.3
+BOT_ID = 7665418627
+
+
+def rss_bytes():
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+async def fill(storage, users):
+    from aiogram.fsm.storage.base import StorageKey
+    from models import Form
+
+    abandon_every = round(1 / ABANDONED)
+    for user_id in range(10**9, 10**9 + users):
+        key = StorageKey(bot_id=BOT_ID, chat_id=user_id, user_id=user_id)
+        await storage.set_state(key, Form.waiting_for_name)
+        await storage.set_data(key, {"full_name": f"Foydalanuvchi {user_id}"})
+        await storage.set_state(key, Form.waiting_for_phone)
+        if user_id % abandon_every:
+            await storage.set_data(key, {})
+            await storage.set_state(key, Form.main_menu)
+
+
+def measure(kind, users):
+    from config_user import FSM_STORAGE_TTL, FSM_STORAGE_MAX_ENTRIES
+
+    if kind == "memory":
+        from aiogram.fsm.storage.memory import MemoryStorage
+        storage = MemoryStorage()
+    else:
+        from utils.fsm_storage import BoundedMemoryStorage
+        cap = FSM_STORAGE_MAX_ENTRIES if kind == "bounded-capped" else users
+        storage = BoundedMemoryStorage(FSM_STORAGE_TTL, cap)
+
+    before = rss_bytes()
+    started = time.perf_counter()
+    asyncio.run(fill(storage, users))
+    elapsed = time.perf_counter() - started
+    grown = rss_bytes() - before
+
+    line = (f"{kind:15} {grown / 2**20:8.1f} MiB RSS  {grown / users:6.0f} B/user  "
+            f"{elapsed:5.1f}s")
+    if kind != "memory":
+        usage = storage.memory_usage()
+        line += (f"  estimate {usage['total_bytes'] / 2**20:.1f} MiB "
+                 f"({usage['bytes_per_entry']} B x {usage['entries']} entries, "
+                 f"{usage['evicted']} evicted)")
+    print(line, flush=True)
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else USERS
+    if len(sys.argv) > 2:
+        measure(sys.argv[2], users)
+        return
+
+    print(f"{users} users, {ABANDONED:.0%} abandoning registration after the name")
+    for kind in ("memory", "bounded", "bounded-capped"):
+        subprocess.run(
+            [sys.executable, "-m", "benchmarks.fsm_storage_memory", str(users), kind],
+            check=True
+        )
+
+
+if __name__ == "__main__":
+    main()
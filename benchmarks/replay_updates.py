@@ -0,0 +1,186 @@
+"""Replay recorded updates through the bot against a fake Bot API.
+
+Record with RECORD_UPDATES_DIR in config_user.py / config_admin.py, then run
+from the repository root against a local database:
+
+    python -m benchmarks.replay_updates recordings/user-*.jsonl.gz
+    python -m benchmarks.replay_updates --bot admin --speed 10 recordings/admin-*.jsonl.gz
+    python -m benchmarks.replay_updates --speed max --concurrency 1 recordings/user-*.jsonl.gz
+
+Updates go through ``create_dispatcher()`` of main_user.py or main_admin.py
+and ``Dispatcher.feed_update``, so middlewares, handlers and database queries
+run exactly as when polling; only Bot API calls are answered locally.
+``--speed`` keeps the recorded timing (``original``), compresses it by a
+factor (``10``) or feeds updates as fast as ``--concurrency`` allows
+(``max``). Updates always start in recorded order; ``--concurrency 1`` also
+finishes each one before the next starts, which makes a replay repeatable.
+Latency is measured from an update's scheduled time, so falling behind the
+recorded pace shows up as latency. Users from the recording only exist in
+the database if it is a copy of the recorded one (``pg_dump``/``pg_restore``).
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import time
+from collections import Counter
+from datetime import datetime
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import GetChatMember, SendDocument
+from aiogram.types import Chat, ChatMemberMember, Document, Message, Update, User
+
+
+class FakeSession(BaseSession):
+    """Answers every Bot API call locally after ``latency`` seconds"""
+
+    def __init__(self, latency=0.0):
+        super().__init__()
+        self.latency = latency
+        self.calls = Counter()
+        self._message_id = 0
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls[type(method).__name__] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        returning = method.__returning__
+        if isinstance(method, GetChatMember):
+            return ChatMemberMember(user=User(id=method.user_id, is_bot=False, first_name="Replay"))
+        if returning is Message:
+            self._message_id += 1
+            chat_id = getattr(method, "chat_id", 0)
+            document = None
+            if isinstance(method, SendDocument):
+                # Admin jobs keep the file_id of uploaded reports
+                file_id = f"replay-{self._message_id}"
+                document = Document(file_id=file_id, file_unique_id=file_id)
+            return Message(
+                message_id=self._message_id,
+                date=datetime.now(),
+                chat=Chat(id=chat_id if isinstance(chat_id, int) else 0, type="private"),
+                document=document,
+            )
+        if returning is User:
+            return User(id=bot.id, is_bot=True, first_name="Replay")
+        if returning is bool:
+            return True
+        return None
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self):
+        pass
+
+
+def read_records(paths):
+    """(timestamp, update JSON) pairs of the recordings, in recorded order"""
+    records = []
+    for path in paths:
+        with gzip.open(path, "rt", encoding="utf-8") as file:
+            for line in file:
+                if line.strip():
+                    record = json.loads(line)
+                    records.append((record["t"], record["update"]))
+    records.sort(key=lambda record: record[0])
+    return records
+
+
+def create_bot_and_dispatcher(kind, session):
+    if kind == "user":
+        from config_user import BOT_TOKEN
+        from main_user import create_dispatcher
+        bot = Bot(token=BOT_TOKEN, session=session)
+        return bot, create_dispatcher(record_dir="", readiness_file="")
+
+    from config_admin import BOT_TOKEN
+    from main_admin import create_dispatcher
+    bot = Bot(token=BOT_TOKEN, session=session)
+    return bot, create_dispatcher(bot, record_dir="")
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def replay(args):
+    from db import create_tables
+
+    records = read_records(args.files)
+    if not records:
+        print("No updates in the given files")
+        return
+
+    session = FakeSession(args.api_latency)
+    bot, dp = create_bot_and_dispatcher(args.bot, session)
+    await create_tables()
+    await dp.emit_startup(bot=bot, bots=[bot], dispatcher=dp, **dp.workflow_data)
+
+    speed = None if args.speed == "max" else 1.0 if args.speed == "original" else float(args.speed)
+    slots = asyncio.Semaphore(args.concurrency)
+    latencies = []
+    errors = Counter()
+
+    async def feed(update, scheduled):
+        try:
+            await dp.feed_update(bot, Update.model_validate(update, context={"bot": bot}))
+        except Exception as e:
+            errors[type(e).__name__] += 1
+        finally:
+            latencies.append(time.perf_counter() - scheduled)
+            slots.release()
+
+    first = records[0][0]
+    started = time.perf_counter()
+    tasks = []
+    try:
+        for recorded_at, update in records:
+            scheduled = started if speed is None else started + (recorded_at - first) / speed
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await slots.acquire()
+            if speed is None:
+                scheduled = time.perf_counter()
+            tasks.append(asyncio.create_task(feed(update, scheduled)))
+        await asyncio.gather(*tasks)
+    finally:
+        elapsed = time.perf_counter() - started
+        await dp.emit_shutdown(bot=bot, bots=[bot], dispatcher=dp, **dp.workflow_data)
+
+    latencies.sort()
+    recorded_span = records[-1][0] - first
+    print(f"{len(latencies)} updates in {elapsed:.2f}s (recorded over {recorded_span:.0f}s), "
+          f"{len(latencies) / elapsed:.0f} updates/s")
+    print(f"latency ms: p50 {percentile(latencies, 0.5) * 1000:.1f}  "
+          f"p90 {percentile(latencies, 0.9) * 1000:.1f}  "
+          f"p99 {percentile(latencies, 0.99) * 1000:.1f}  max {latencies[-1] * 1000:.1f}")
+    print(f"Bot API calls: {dict(session.calls.most_common())}")
+    if errors:
+        print(f"errors: {dict(errors)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded updates against a fake Bot API")
+    parser.add_argument("files", nargs="+", help="recorded .jsonl.gz files")
+    parser.add_argument("--bot", choices=("user", "admin"), default="user")
+    parser.add_argument("--speed", default="original",
+                        help="'original', a speed-up factor such as 10, or 'max'")
+    parser.add_argument("--concurrency", type=int, default=1000,
+                        help="updates processed at the same time (1 = one after another)")
+    parser.add_argument("--api-latency", type=float, default=0.0,
+                        help="seconds each fake Bot API call takes")
+    args = parser.parse_args()
+    if args.speed not in ("original", "max"):
+        try:
+            float(args.speed)
+        except ValueError:
+            parser.error("--speed must be 'original', 'max' or a number")
+    asyncio.run(replay(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""Demonstrate per-user update serialization through the real user bot.
+
+Run from the repository root against a local database:
+
+    python -m benchmarks.user_lock_race
+    python -m benchmarks.user_lock_race --backend postgres
+
+Updates go through ``create_dispatcher()`` of main_user.py and
+``Dispatcher.feed_update`` with a fake Bot API (see replay_updates.py), so
+the FSM middleware, its events isolation and the real handlers run.
+
+Three scenarios run, first without serialization and then with ``--backend``:
+
+- name race: every user in ``Form.waiting_for_name`` sends two names at
+  once. Serialized, the second update sees ``Form.waiting_for_phone`` and
+  the first name is kept; otherwise both reach ``process_name`` and the
+  second overwrites ``full_name``.
+- pool pressure: more users than ``DB_POOL_MAX_SIZE`` open "📋 Mening
+  promokodlarim" at once, which queries the database under the lock. Each
+  run must finish within ``--timeout`` seconds; a lock that held main pool
+  connections would stall here.
+- double submit: every registered user in ``Form.waiting_for_promocode``
+  sends ``--codes`` wrong codes at once, each in its own message. Every
+  update must get exactly one reply and count one wrong attempt.
+
+Exits with status 1 if a scenario fails with ``--backend``; the
+unserialized results are only printed for comparison.
+"""
+import argparse
+import asyncio
+import sys
+import time
+from collections import Counter
+
+from aiogram import Bot
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.methods import SendMessage
+from aiogram.types import Update
+
+from benchmarks.replay_updates import FakeSession
+from config import DB_POOL_MAX_SIZE
+from config_user import BOT_TOKEN, FLOOD_STATE_LIMITS, MAX_WRONG_ATTEMPTS
+from models import Form
+from utils.promocode_generator import generate_promocode
+
+BOT_ID = int(BOT_TOKEN.split(":")[0])
+
+# Codes a user can send at once without flood control dropping one or the
+# user getting blocked
+MAX_CODES = min(FLOOD_STATE_LIMITS[Form.waiting_for_promocode.state][1], MAX_WRONG_ATTEMPTS - 1)
+
+
+class ReplyCountingSession(FakeSession):
+    """Fake Bot API that also counts sent messages per chat"""
+
+    def __init__(self, latency=0.0):
+        super().__init__(latency)
+        self.replies = Counter()
+
+    async def make_request(self, bot, method, timeout=None):
+        if isinstance(method, SendMessage):
+            self.replies[method.chat_id] += 1
+        return await super().make_request(bot, method, timeout)
+
+
+def text_update(update_id, user_id, text):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Race"},
+            "text": text,
+        },
+    }
+
+
+async def feed_all(dp, bot, updates, timeout):
+    """Feed updates concurrently; seconds taken, or None if they stalled"""
+    started = time.perf_counter()
+    tasks = [
+        asyncio.create_task(dp.feed_update(bot, Update.model_validate(update, context={"bot": bot})))
+        for update in updates
+    ]
+    done, pending = await asyncio.wait(tasks, timeout=timeout)
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return None if pending else time.perf_counter() - started
+
+
+async def name_race(backend, users, first_user, latency, timeout):
+    from main_user import create_dispatcher
+
+    bot = Bot(token=BOT_TOKEN, session=FakeSession(latency))
+    dp = create_dispatcher(record_dir="", lock_backend=backend, readiness_file="")
+    user_ids = range(first_user, first_user + users)
+    for user_id in user_ids:
+        key = StorageKey(bot_id=BOT_ID, chat_id=user_id, user_id=user_id)
+        await dp.storage.set_state(key, Form.waiting_for_name)
+
+    updates = []
+    for user_id in user_ids:
+        updates.append(text_update(len(updates) + 1, user_id, f"Birinchi {user_id}"))
+        updates.append(text_update(len(updates) + 1, user_id, f"Ikkinchi {user_id}"))
+    elapsed = await feed_all(dp, bot, updates, timeout)
+
+    overwritten = 0
+    for user_id in user_ids:
+        key = StorageKey(bot_id=BOT_ID, chat_id=user_id, user_id=user_id)
+        data = await dp.storage.get_data(key)
+        overwritten += data.get("full_name") != f"Birinchi {user_id}"
+    await dp.fsm.close()
+    return overwritten, elapsed
+
+
+async def pool_pressure(backend, users, first_user, latency, timeout):
+    from main_user import create_dispatcher
+
+    bot = Bot(token=BOT_TOKEN, session=FakeSession(latency))
+    dp = create_dispatcher(record_dir="", lock_backend=backend, readiness_file="")
+    user_ids = range(first_user, first_user + users)
+    for user_id in user_ids:
+        key = StorageKey(bot_id=BOT_ID, chat_id=user_id, user_id=user_id)
+        await dp.storage.set_state(key, Form.main_menu)
+
+    updates = [
+        text_update(i + 1, user_id, "📋 Mening promokodlarim")
+        for i, user_id in enumerate(user_ids)
+    ]
+    elapsed = await feed_all(dp, bot, updates, timeout)
+    await dp.fsm.close()
+    return elapsed
+
+
+async def double_submit(backend, users, first_user, codes, latency, timeout):
+    """Users whose wrong attempts or replies don't match the codes sent"""
+    from db import register_user, unblock_user, get_user
+    from main_user import create_dispatcher
+
+    session = ReplyCountingSession(latency)
+    bot = Bot(token=BOT_TOKEN, session=session)
+    dp = create_dispatcher(record_dir="", lock_backend=backend, readiness_file="")
+    user_ids = range(first_user, first_user + users)
+    for user_id in user_ids:
+        await register_user(user_id, f"Race {user_id}", f"+998{user_id}")
+        await unblock_user(user_id)
+        key = StorageKey(bot_id=BOT_ID, chat_id=user_id, user_id=user_id)
+        await dp.storage.set_state(key, Form.waiting_for_promocode)
+
+    updates = []
+    for user_id in user_ids:
+        for _ in range(codes):
+            # Random codes of the right format, nonexistent in practice
+            updates.append(text_update(len(updates) + 1, user_id, generate_promocode()))
+    elapsed = await feed_all(dp, bot, updates, timeout)
+
+    mismatched = 0
+    for user_id in user_ids:
+        user = await get_user(user_id)
+        mismatched += user['wrong_attempts'] != codes or session.replies[user_id] != codes
+    await dp.fsm.close()
+    return mismatched, elapsed
+
+
+def describe(elapsed):
+    return "stalled" if elapsed is None else f"{elapsed:.2f}s"
+
+
+async def run(args):
+    from db import create_tables
+
+    await create_tables()
+    # Distinct users per run, so flood control buckets don't carry over
+    first_user = 10**9
+    failed = False
+    for backend in (None, args.backend):
+        name = backend or "unserialized"
+        overwritten, elapsed = await name_race(
+            backend, args.users, first_user, args.api_latency, args.timeout
+        )
+        first_user += args.users
+        print(f"{name:13} name race:     {overwritten}/{args.users} names overwritten, "
+              f"{describe(elapsed)}")
+        name_failed = overwritten or elapsed is None
+
+        users = DB_POOL_MAX_SIZE * 2
+        elapsed = await pool_pressure(backend, users, first_user, args.api_latency, args.timeout)
+        first_user += users
+        print(f"{name:13} pool pressure: {users} users, {describe(elapsed)}")
+        pool_failed = elapsed is None
+
+        mismatched, elapsed = await double_submit(
+            backend, args.users, first_user, args.codes, args.api_latency, args.timeout
+        )
+        first_user += args.users
+        print(f"{name:13} double submit: {mismatched}/{args.users} users with wrong counts "
+              f"or replies, {describe(elapsed)}")
+        submit_failed = mismatched or elapsed is None
+
+        if backend:
+            failed = name_failed or pool_failed or submit_failed
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Race concurrent updates of one user through the user bot")
+    parser.add_argument("--backend", choices=("memory", "postgres"), default="memory")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--api-latency", type=float, default=0.005,
+                        help="seconds each fake Bot API call takes")
+    parser.add_argument("--codes", type=int, default=MAX_CODES,
+                        help=f"wrong codes each user sends at once, at most {MAX_CODES}")
+    parser.add_argument("--timeout", type=float, default=30)
+    args = parser.parse_args()
+    if not 1 <= args.codes <= MAX_CODES:
+        parser.error(f"--codes must be between 1 and {MAX_CODES}")
+    if asyncio.run(run(args)):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
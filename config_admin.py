@@ -16,3 +16,27 @@ DB_PASS = "1010"  # Replace with your database password
 
 # Postgres connection string
 DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+
+# Background job settings
+JOB_WORKERS = 2  # Jobs processed at the same time
+HEAVY_JOB_CONCURRENCY = 1  # Exports/generations allowed to run at once
+
+# Report cache settings
+REPORT_CACHE_MAX_ROWS = 200000  # Largest report kept in memory for incremental rebuilds
+
+# Characters of generated promocodes: "safe" leaves out O/0, I/1, L, S/5, B/8
+# and Z/2 so printed codes can't be mistyped, "full" uses all of A-Z and 0-9
+PROMOCODE_ALPHABET = "safe"
+
+# User search: results per page, and most matches ranked per query (very
+# common names show the best of the first SEARCH_MAX_CANDIDATES matches)
+SEARCH_PAGE_SIZE = 5
+SEARCH_MAX_CANDIDATES = 1000
+
+# Users shown in the admin leaderboard
+LEADERBOARD_TOP_N = 20
+
+# Directory to record every incoming update to (gzip JSONL, one file per
+# hour) for replay with benchmarks/replay_updates.py; empty to disable.
+# Recordings contain users' names and phone numbers, handle them accordingly
+RECORD_UPDATES_DIR = ""
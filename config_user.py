@@ -19,3 +19,62 @@ BLOCK_TIME_SECONDS = 3600  # 1 hour
 
 # Postgres connection string
 DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+
+# Per-user update serialization: "memory" for a single bot process,
+# "postgres" (advisory locks) when several processes poll the same bot
+USER_LOCK_BACKEND = "memory"
+# Connections for the "postgres" backend, one per user whose update is being
+# processed; kept apart from the main pool (DB_POOL_MAX_SIZE)
+USER_LOCK_POOL_SIZE = 20
+
+# File created once the bot is polling and removed on shutdown; point the
+# readiness probe of the process supervisor at it (empty to disable)
+READINESS_FILE = "/tmp/promocode-user-bot.ready"
+
+# Submission attempt log: flushed when FLUSH_SIZE events are buffered or
+# every FLUSH_INTERVAL seconds; submissions wait once MAX_BUFFER is reached
+ATTEMPT_LOG_FLUSH_SIZE = 1000
+ATTEMPT_LOG_FLUSH_INTERVAL = 2.0
+ATTEMPT_LOG_MAX_BUFFER = 50000
+
+# Abuse detection over a sliding window (see utils/abuse_detector.py)
+ABUSE_WINDOW_SECONDS = 600
+ABUSE_PHONE_LIMIT = 3  # Registrations allowed per phone number in the window
+ABUSE_PREFIX_LENGTH = 3  # Leading code characters grouped together
+ABUSE_PREFIX_LIMIT = 50  # Wrong attempts per code prefix before it counts as hot
+# ...and the share of all wrong attempts in the window it must also reach,
+# so ordinary typos spread over all prefixes never make one hot
+ABUSE_PREFIX_SHARE = 0.05
+ABUSE_GLOBAL_LIMIT = 2000  # Wrong attempts across all users reported as a burst
+ABUSE_RECENT_USERS = 100000  # Users with a recent wrong attempt tracked exactly
+ABUSE_REPORT_INTERVAL = 60  # Seconds between reports saved for the admin
+
+# Most promocodes accepted in one message (separated by spaces or new lines)
+MAX_CODES_PER_MESSAGE = 20
+
+
+# In-process caches kept in sync through the event bus (see utils/caches.py)
+USER_STATUS_CACHE_SIZE = 100000  # Registered users whose block state is cached
+WRONG_CODE_CACHE_SIZE = 50000  # Recently submitted nonexistent codes
+
+# FSM state storage: chats idle for TTL seconds lose their state (the bot
+# then treats them as being in the main menu); at most MAX_ENTRIES are kept
+FSM_STORAGE_TTL = 24 * 3600
+FSM_STORAGE_MAX_ENTRIES = 500000
+FSM_STORAGE_REPORT_INTERVAL = 3600  # Seconds between memory and flood control log lines
+
+# Flood control: (messages per second, burst) per user, stricter while a
+# promocode is expected; excess messages are dropped before any handler
+FLOOD_DEFAULT_LIMIT = (1.0, 5)
+FLOOD_STATE_LIMITS = {
+    "Form:waiting_for_promocode": (0.2, 3),
+}
+FLOOD_NOTICE_WINDOW = 10  # Seconds between "too many messages" notices per user
+
+# Users shown in the leaderboard
+LEADERBOARD_TOP_N = 10
+
+# Directory to record every incoming update to (gzip JSONL, one file per
+# hour) for replay with benchmarks/replay_updates.py; empty to disable.
+# Recordings contain users' names and phone numbers, handle them accordingly
+RECORD_UPDATES_DIR = ""
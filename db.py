@@ -1,56 +1,598 @@
 import asyncio
+import json
+import re
+import time
 import asyncpg
-from config import DATABASE_URL
+from contextlib import asynccontextmanager
+from config import DATABASE_URL, DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE
+from config import REPLICA_DATABASE_URLS, REPLICA_READ_YOUR_WRITES_SECONDS, REPLICA_RETRY_SECONDS
+from config import EVENTS_CHANNEL
+from utils.promocode_generator import CONFUSABLE_CHARS, CANONICAL_CHARS, canonicalize_promocode
 from datetime import datetime
 
+# Bump whenever the DDL in create_tables changes, so that running databases
+# re-apply it; otherwise startup skips the DDL entirely
+SCHEMA_VERSION = 7
+
+# Advisory lock key serializing schema upgrades of concurrently starting bots
+SCHEMA_LOCK_KEY = 7_140_001
+# Advisory lock serializing code inserts, so two inserts can't both pass the
+# check for codes that already exist in another live campaign
+PROMOCODES_LOCK_KEY = 7_140_002
+# Digits a search needs to match phone numbers; fewer would match almost
+# every number, and the trigram index can't narrow it down
+SEARCH_MIN_PHONE_DIGITS = 3
+
+# Queries on the user submission path. Every new pool connection runs them
+# once so their prepared statements are cached before the first real update.
+# Registration and remaining block time in one row; no row if not registered
+USER_STATUS_SQL = '''
+    SELECT GREATEST(EXTRACT(EPOCH FROM blocked_until - CURRENT_TIMESTAMP), 0) as blocked_seconds
+    FROM users WHERE telegram_id = $1
+'''
+# Claims every still-unused code in one statement (see redeem_promocodes).
+# Codes are looked up by their confusable-normalized form; a typed code
+# resolves to the code spelled exactly like it, otherwise to the only code
+# sharing its normalized form (several such codes are ambiguous: wrong)
+REDEEM_PROMOCODES_SQL = '''
+    WITH input AS (
+        SELECT code, norm, ord
+        FROM unnest($1::text[], $3::text[]) WITH ORDINALITY AS t(code, norm, ord)
+    ),
+    candidates AS (
+        SELECT i.code as input_code, p.campaign_id, p.id, p.code, p.status,
+               p.code = i.code as exact,
+               MIN(p.code) OVER w = MAX(p.code) OVER w as unambiguous
+        FROM input i
+        JOIN promocodes p ON p.code_norm = i.norm
+        WINDOW w AS (PARTITION BY i.code)
+    ),
+    matched AS (
+        SELECT * FROM candidates WHERE exact OR unambiguous
+    ),
+    found AS (
+        SELECT DISTINCT input_code as code FROM matched
+    ),
+    claimed AS (
+        UPDATE promocodes p SET status = 'used'
+        FROM (
+            SELECT DISTINCT ON (input_code) input_code, campaign_id, id
+            FROM matched
+            WHERE status = 'unused'
+            ORDER BY input_code, campaign_id DESC
+        ) c
+        WHERE p.campaign_id = c.campaign_id AND p.id = c.id AND p.status = 'unused'
+        RETURNING p.campaign_id, p.id, c.input_code as code
+    ),
+    linked AS (
+        INSERT INTO user_promocodes (campaign_id, user_id, promocode_id)
+        SELECT campaign_id, $2, id FROM claimed
+    ),
+    counters AS (
+        UPDATE users SET wrong_attempts =
+            CASE WHEN EXISTS (SELECT 1 FROM claimed) THEN 0 ELSE wrong_attempts END
+            + (SELECT COUNT(*) FROM input WHERE code NOT IN (SELECT code FROM found)),
+            redeemed_count = redeemed_count + (SELECT COUNT(*) FROM claimed),
+            redeemed_at = CASE WHEN EXISTS (SELECT 1 FROM claimed)
+                               THEN CURRENT_TIMESTAMP ELSE redeemed_at END
+        WHERE telegram_id = $2
+        RETURNING wrong_attempts, redeemed_count
+    )
+    SELECT i.code,
+           CASE WHEN c.code IS NOT NULL THEN 'accepted'
+                WHEN f.code IS NOT NULL THEN 'used'
+                ELSE 'wrong' END as outcome,
+           (SELECT wrong_attempts FROM counters) as wrong_attempts,
+           (SELECT redeemed_count FROM counters) as redeemed_count
+    FROM input i
+    LEFT JOIN claimed c ON c.code = i.code
+    LEFT JOIN found f ON f.code = i.code
+    ORDER BY i.ord
+'''
+GET_USER_PROMOCODES_SQL = '''
+    SELECT p.code, up.submitted_at
+    FROM user_promocodes up
+    JOIN promocodes p ON up.campaign_id = p.campaign_id AND up.promocode_id = p.id
+    WHERE up.user_id = $1
+    ORDER BY up.submitted_at DESC
+'''
+
 # Create connection pool
 pool = None
 
+async def _warm_connection(conn):
+    """Populate the statement cache of a new connection with the hot queries"""
+    try:
+        await conn.fetchrow(USER_STATUS_SQL, 0)
+        await conn.fetch(GET_USER_PROMOCODES_SQL, 0)
+        # Matches no codes and no user, so it changes nothing
+        await conn.fetch(REDEEM_PROMOCODES_SQL, [], 0, [])
+    except asyncpg.PostgresError:
+        # Tables don't exist yet on the very first start
+        pass
+
 async def get_pool():
     global pool
     if pool is None:
-        pool = await asyncpg.create_pool(DATABASE_URL)
+        # min_size connections are opened (and warmed) before this returns
+        pool = await asyncpg.create_pool(
+            DATABASE_URL,
+            min_size=DB_POOL_MIN_SIZE,
+            max_size=DB_POOL_MAX_SIZE,
+            init=_warm_connection
+        )
     return pool
 
+# Read replica pools, created on first use; None while a replica is unavailable
+replica_pools = [None] * len(REPLICA_DATABASE_URLS)
+_replica_retry_at = [0.0] * len(REPLICA_DATABASE_URLS)
+
+# Users whose next reads must see their own writes: telegram_id -> deadline
+_recent_writers = {}
+
+# Errors after which a replica read is retried on the primary
+_REPLICA_ERRORS = (
+    OSError,
+    asyncio.TimeoutError,
+    asyncpg.exceptions.PostgresConnectionError,
+    asyncpg.exceptions.InterfaceError,
+    # Query cancelled because of a conflict with WAL replay
+    asyncpg.exceptions.SerializationError,
+)
+
+def _note_write(telegram_id):
+    """Route the user's reads to the primary until replicas have caught up"""
+    now = time.monotonic()
+    if len(_recent_writers) > 10000:
+        for user_id, deadline in list(_recent_writers.items()):
+            if deadline < now:
+                del _recent_writers[user_id]
+    _recent_writers[telegram_id] = now + REPLICA_READ_YOUR_WRITES_SECONDS
+
+def _replica_failed(index, error):
+    print(f"Read replica {index} failed, using primary: {error}")
+    _replica_retry_at[index] = time.monotonic() + REPLICA_RETRY_SECONDS
+
+async def _get_replica_pool(key, telegram_id=None):
+    """Pick the replica for a read, or None to read from the primary
+
+    The same key always maps to the same replica, so repeated reads of one
+    report or one user never go back in time by switching replicas.
+    """
+    if not replica_pools:
+        return None, None
+    if telegram_id is not None and _recent_writers.get(telegram_id, 0) > time.monotonic():
+        return None, None
+    
+    index = hash(key) % len(replica_pools)
+    if replica_pools[index] is None:
+        if _replica_retry_at[index] > time.monotonic():
+            return None, None
+        try:
+            replica_pools[index] = await asyncpg.create_pool(
+                REPLICA_DATABASE_URLS[index],
+                min_size=1,
+                max_size=DB_POOL_MAX_SIZE
+            )
+        except Exception as e:
+            _replica_failed(index, e)
+            return None, None
+    elif _replica_retry_at[index] > time.monotonic():
+        return None, None
+    return replica_pools[index], index
+
+async def _read(method, query, *args, key=None, telegram_id=None):
+    """Run a read-only query on a replica, falling back to the primary"""
+    replica, index = await _get_replica_pool(key, telegram_id)
+    if replica is not None:
+        try:
+            async with replica.acquire() as conn:
+                return await getattr(conn, method)(query, *args)
+        except _REPLICA_ERRORS as e:
+            _replica_failed(index, e)
+    
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        return await getattr(conn, method)(query, *args)
+
+@asynccontextmanager
+async def _acquire_read(key=None):
+    """Acquire a connection for a long read, from a replica when one is reachable"""
+    replica, index = await _get_replica_pool(key)
+    if replica is not None:
+        try:
+            conn = await replica.acquire()
+        except _REPLICA_ERRORS as e:
+            _replica_failed(index, e)
+        else:
+            try:
+                yield conn
+            finally:
+                await replica.release(conn)
+            return
+    
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        yield conn
+
+async def _publish(conn, event, **fields):
+    """Notify other processes that cached data changed
+
+    Sent on the writer's connection, so inside a transaction the event is
+    only delivered if the transaction commits.
+    """
+    await conn.execute(
+        "SELECT pg_notify($1, $2)", EVENTS_CHANNEL, json.dumps({'event': event, **fields})
+    )
+
+async def _get_schema_version(conn):
+    """Get the applied schema version, 0 for a database without one"""
+    if await conn.fetchval("SELECT to_regclass('schema_version')") is None:
+        return 0
+    return await conn.fetchval('SELECT MAX(version) FROM schema_version') or 0
+
+def _partition(table, campaign_id):
+    """Name of the per-campaign partition of a partitioned table"""
+    return f"{table}_c{int(campaign_id)}"
+
+async def _create_campaign_partitions(conn, campaign_id):
+    """Create promocodes/user_promocodes partitions for a campaign"""
+    await conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {_partition('promocodes', campaign_id)}
+        PARTITION OF promocodes FOR VALUES IN ({int(campaign_id)})
+    ''')
+    await conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {_partition('user_promocodes', campaign_id)}
+        PARTITION OF user_promocodes FOR VALUES IN ({int(campaign_id)})
+    ''')
+
+async def _migrate_legacy_tables(conn):
+    """Move rows of the old single-campaign tables into campaign partitions"""
+    # relkind is a "char", which asyncpg would return as bytes
+    relkind = await conn.fetchval('''
+        SELECT relkind::text FROM pg_class
+        WHERE relname = 'promocodes' AND relnamespace = 'public'::regnamespace
+    ''')
+    if relkind != 'r':
+        return False
+
+    await conn.execute('ALTER TABLE user_promocodes RENAME TO user_promocodes_legacy')
+    await conn.execute('ALTER TABLE promocodes RENAME TO promocodes_legacy')
+    return True
+
+async def _code_norm_is_current(conn):
+    """Whether promocodes.code_norm exists and is generated with the current mapping"""
+    expression = await conn.fetchval('''
+        SELECT pg_get_expr(d.adbin, d.adrelid)
+        FROM pg_attribute a
+        JOIN pg_attrdef d ON d.adrelid = a.attrelid AND d.adnum = a.attnum
+        WHERE a.attrelid = to_regclass('promocodes') AND a.attname = 'code_norm'
+    ''')
+    if expression is None:
+        return False
+    return f"'{CONFUSABLE_CHARS}'" in expression and f"'{CANONICAL_CHARS}'" in expression
+
 async def create_tables():
-    """Create necessary database tables if they don't exist"""
+    """Create necessary database tables if they don't exist
+
+    Does a single cheap query when the schema is already at SCHEMA_VERSION.
+    """
     pool = await get_pool()
     
     async with pool.acquire() as conn:
-        # Create promocodes table
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS promocodes (
-                id SERIAL PRIMARY KEY,
-                code VARCHAR(20) UNIQUE NOT NULL,
-                status VARCHAR(10) DEFAULT 'unused' CHECK (status IN ('used', 'unused')),
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
+        if await _get_schema_version(conn) >= SCHEMA_VERSION:
+            return
         
-        # Create users table
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id SERIAL PRIMARY KEY,
-                telegram_id BIGINT UNIQUE NOT NULL,
-                full_name VARCHAR(100) NOT NULL,
-                phone_number VARCHAR(20) NOT NULL,
-                registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                wrong_attempts INT DEFAULT 0,
-                blocked_until TIMESTAMP
-            )
+        async with conn.transaction():
+            # Another process may be upgrading right now; wait for it and
+            # re-check instead of running the DDL twice
+            await conn.execute('SELECT pg_advisory_xact_lock($1)', SCHEMA_LOCK_KEY)
+            version = await _get_schema_version(conn)
+            if version >= SCHEMA_VERSION:
+                return
+            
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INT NOT NULL,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+
+            # Create campaigns table
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS campaigns (
+                    id SERIAL PRIMARY KEY,
+                    name VARCHAR(100) NOT NULL,
+                    status VARCHAR(10) DEFAULT 'active' CHECK (status IN ('active', 'archived')),
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    archived_at TIMESTAMP
+                )
+            ''')
+
+            # Create users table
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS users (
+                    id SERIAL PRIMARY KEY,
+                    telegram_id BIGINT UNIQUE NOT NULL,
+                    full_name VARCHAR(100) NOT NULL,
+                    phone_number VARCHAR(20) NOT NULL,
+                    registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    wrong_attempts INT DEFAULT 0,
+                    blocked_until TIMESTAMP
+                )
+            ''')
+            
+            # Trigram indexes for the admin user search: partial and fuzzy
+            # name matches, and phone fragments whatever their formatting
+            await conn.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            await conn.execute('''
+                ALTER TABLE users ADD COLUMN IF NOT EXISTS phone_norm VARCHAR(20)
+                GENERATED ALWAYS AS (regexp_replace(phone_number, '[^0-9]', '', 'g')) STORED
+            ''')
+            await conn.execute('''
+                CREATE INDEX IF NOT EXISTS users_full_name_trgm_idx
+                ON users USING GIN (full_name gin_trgm_ops)
+            ''')
+            await conn.execute('''
+                CREATE INDEX IF NOT EXISTS users_phone_norm_trgm_idx
+                ON users USING GIN (phone_norm gin_trgm_ops)
+            ''')
+            
+            # Codes redeemed per user and when that last changed, kept by the
+            # redemption statements; the leaderboard loads and reconciles
+            # from these instead of aggregating user_promocodes
+            await conn.execute('''
+                ALTER TABLE users ADD COLUMN IF NOT EXISTS redeemed_count INT NOT NULL DEFAULT 0
+            ''')
+            await conn.execute('''
+                ALTER TABLE users ADD COLUMN IF NOT EXISTS redeemed_at TIMESTAMP
+            ''')
+            await conn.execute('''
+                CREATE INDEX IF NOT EXISTS users_redeemed_at_idx ON users (redeemed_at)
+            ''')
+
+            # Databases created before campaigns existed keep their codes in
+            # plain tables; those rows become the first campaign below
+            migrated = await _migrate_legacy_tables(conn)
+
+            # Create promocodes table, partitioned by campaign so an archived
+            # campaign can be detached without touching the hot indexes
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS promocodes (
+                    id SERIAL,
+                    campaign_id INTEGER NOT NULL REFERENCES campaigns(id),
+                    code VARCHAR(20) NOT NULL,
+                    status VARCHAR(10) DEFAULT 'unused' CHECK (status IN ('used', 'unused')),
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (campaign_id, id),
+                    UNIQUE (campaign_id, code)
+                ) PARTITION BY LIST (campaign_id)
+            ''')
+            # Lookups go through code_norm; the plain code index is unused
+            await conn.execute('DROP INDEX IF EXISTS promocodes_code_idx')
+            # Code with confusable characters mapped to one spelling, for
+            # typo-tolerant lookups. Adding it fills every live partition.
+            # ADD COLUMN IF NOT EXISTS keeps an existing column as it is, so
+            # a column generated with another mapping is dropped (with its
+            # index) and added again
+            if not await _code_norm_is_current(conn):
+                await conn.execute('ALTER TABLE promocodes DROP COLUMN IF EXISTS code_norm')
+            await conn.execute(f'''
+                ALTER TABLE promocodes ADD COLUMN IF NOT EXISTS code_norm VARCHAR(20)
+                GENERATED ALWAYS AS (translate(code, '{CONFUSABLE_CHARS}', '{CANONICAL_CHARS}')) STORED
+            ''')
+            await conn.execute('''
+                CREATE INDEX IF NOT EXISTS promocodes_code_norm_idx ON promocodes (code_norm)
+            ''')
+
+            # Create user_promocodes table for many-to-many relationship
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS user_promocodes (
+                    id SERIAL,
+                    campaign_id INTEGER NOT NULL,
+                    user_id BIGINT REFERENCES users(telegram_id) ON DELETE CASCADE,
+                    promocode_id INTEGER NOT NULL,
+                    submitted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (campaign_id, id),
+                    UNIQUE (campaign_id, user_id, promocode_id),
+                    CONSTRAINT user_promocodes_promocode_fk FOREIGN KEY (campaign_id, promocode_id)
+                        REFERENCES promocodes(campaign_id, id) ON DELETE CASCADE
+                ) PARTITION BY LIST (campaign_id)
+            ''')
+            await conn.execute('''
+                CREATE INDEX IF NOT EXISTS user_promocodes_user_idx ON user_promocodes (user_id)
+            ''')
+
+            # Create append-only log of every promocode submission attempt,
+            # partitioned by month (partitions are added by the writer)
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS submission_attempts (
+                    user_id BIGINT NOT NULL,
+                    code_hash BYTEA NOT NULL,
+                    outcome VARCHAR(10) NOT NULL,
+                    attempted_at TIMESTAMP NOT NULL
+                ) PARTITION BY RANGE (attempted_at)
+            ''')
+            await conn.execute('''
+                CREATE INDEX IF NOT EXISTS submission_attempts_user_idx
+                ON submission_attempts (user_id, attempted_at)
+            ''')
+            await conn.execute('''
+                CREATE INDEX IF NOT EXISTS submission_attempts_code_idx
+                ON submission_attempts (code_hash)
+            ''')
+
+            # Create table of abuse summaries saved by the user bot
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS abuse_reports (
+                    id SERIAL PRIMARY KEY,
+                    summary JSONB NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+
+            # Create jobs table for long-running admin operations
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id SERIAL PRIMARY KEY,
+                    kind VARCHAR(30) NOT NULL,
+                    status VARCHAR(10) DEFAULT 'queued' CHECK (status IN ('queued', 'running', 'done', 'failed')),
+                    params JSONB NOT NULL DEFAULT '{}',
+                    chat_id BIGINT NOT NULL,
+                    message_id BIGINT,
+                    progress INT DEFAULT 0,
+                    error TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    started_at TIMESTAMP,
+                    finished_at TIMESTAMP
+                )
+            ''')
+
+            # Make sure there is always a campaign to put codes into
+            await conn.execute('''
+                INSERT INTO campaigns (name)
+                SELECT 'Asosiy kampaniya'
+                WHERE NOT EXISTS (SELECT 1 FROM campaigns)
+            ''')
+
+            campaign_ids = await conn.fetch('''
+                SELECT id FROM campaigns WHERE status = 'active'
+            ''')
+            for row in campaign_ids:
+                await _create_campaign_partitions(conn, row['id'])
+
+            if migrated:
+                campaign_id = await conn.fetchval('SELECT MIN(id) FROM campaigns')
+                await conn.execute('''
+                    INSERT INTO promocodes (id, campaign_id, code, status, created_at)
+                    SELECT id, $1, code, status, created_at FROM promocodes_legacy
+                ''', campaign_id)
+                await conn.execute('''
+                    INSERT INTO user_promocodes (id, campaign_id, user_id, promocode_id, submitted_at)
+                    SELECT id, $1, user_id, promocode_id, submitted_at FROM user_promocodes_legacy
+                ''', campaign_id)
+                await conn.execute('''
+                    SELECT setval(pg_get_serial_sequence('promocodes', 'id'),
+                                  COALESCE((SELECT MAX(id) FROM promocodes), 0) + 1, false)
+                ''')
+                await conn.execute('''
+                    SELECT setval(pg_get_serial_sequence('user_promocodes', 'id'),
+                                  COALESCE((SELECT MAX(id) FROM user_promocodes), 0) + 1, false)
+                ''')
+                await conn.execute('DROP TABLE user_promocodes_legacy')
+                await conn.execute('DROP TABLE promocodes_legacy')
+            
+            # Fill the redeemed counts once, from the codes of live campaigns
+            if version < 6:
+                await conn.execute('''
+                    UPDATE users u SET redeemed_count = c.redeemed_count, redeemed_at = c.redeemed_at
+                    FROM (
+                        SELECT user_id, COUNT(*) as redeemed_count, MAX(submitted_at) as redeemed_at
+                        FROM user_promocodes
+                        GROUP BY user_id
+                    ) c
+                    WHERE u.telegram_id = c.user_id
+                ''')
+
+            await conn.execute('''
+                INSERT INTO schema_version (version) VALUES ($1)
+            ''', SCHEMA_VERSION)
+
+# Campaign database operations
+async def create_campaign(name):
+    """Create a new active campaign with its own partitions"""
+    pool = await get_pool()
+    
+    async with pool.acquire() as conn:
+        try:
+            async with conn.transaction():
+                campaign_id = await conn.fetchval('''
+                    INSERT INTO campaigns (name) VALUES ($1) RETURNING id
+                ''', name)
+                await _create_campaign_partitions(conn, campaign_id)
+                await _publish(conn, 'campaign_changed', campaign_id=campaign_id)
+                return campaign_id
+        except Exception as e:
+            print(f"Error creating campaign: {e}")
+            return None
+
+async def get_campaigns():
+    """Get all campaigns, newest first"""
+    pool = await get_pool()
+    
+    async with pool.acquire() as conn:
+        return await conn.fetch('''
+            SELECT id, name, status, created_at, archived_at
+            FROM campaigns
+            ORDER BY id DESC
         ''')
-        
-        # Create user_promocodes table for many-to-many relationship
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS user_promocodes (
-                id SERIAL PRIMARY KEY,
-                user_id BIGINT REFERENCES users(telegram_id) ON DELETE CASCADE,
-                promocode_id INTEGER REFERENCES promocodes(id) ON DELETE CASCADE,
-                submitted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(user_id, promocode_id)
-            )
+
+async def get_campaign(campaign_id):
+    """Get campaign by ID"""
+    pool = await get_pool()
+    
+    async with pool.acquire() as conn:
+        return await conn.fetchrow('''
+            SELECT id, name, status, created_at, archived_at
+            FROM campaigns WHERE id = $1
+        ''', campaign_id)
+
+async def get_latest_active_campaign():
+    """Get the most recently created active campaign"""
+    pool = await get_pool()
+    
+    async with pool.acquire() as conn:
+        return await conn.fetchrow('''
+            SELECT id, name, status, created_at, archived_at
+            FROM campaigns WHERE status = 'active'
+            ORDER BY id DESC
+            LIMIT 1
         ''')
 
+async def archive_campaign(campaign_id):
+    """Archive a campaign by detaching its partitions from the live tables.
+
+    The detached tables keep all rows (and can still be exported), but they
+    are no longer scanned or indexed by the submission hot path.
+    """
+    pool = await get_pool()
+    user_promocodes_part = _partition('user_promocodes', campaign_id)
+    promocodes_part = _partition('promocodes', campaign_id)
+    
+    async with pool.acquire() as conn:
+        try:
+            async with conn.transaction():
+                updated = await conn.fetchval('''
+                    UPDATE campaigns SET status = 'archived', archived_at = CURRENT_TIMESTAMP
+                    WHERE id = $1 AND status = 'active'
+                    RETURNING id
+                ''', campaign_id)
+                if not updated:
+                    return False
+                
+                # Detach the referencing side first and re-point its foreign
+                # key at the archived codes table, otherwise detaching the
+                # codes partition would violate the constraint
+                await conn.execute(f'''
+                    ALTER TABLE user_promocodes DETACH PARTITION {user_promocodes_part}
+                ''')
+                await conn.execute(f'''
+                    ALTER TABLE {user_promocodes_part} DROP CONSTRAINT user_promocodes_promocode_fk
+                ''')
+                await conn.execute(f'''
+                    ALTER TABLE promocodes DETACH PARTITION {promocodes_part}
+                ''')
+                await conn.execute(f'''
+                    ALTER TABLE {user_promocodes_part}
+                    ADD CONSTRAINT user_promocodes_promocode_fk FOREIGN KEY (campaign_id, promocode_id)
+                        REFERENCES {promocodes_part}(campaign_id, id) ON DELETE CASCADE
+                ''')
+                await _publish(conn, 'campaign_changed', campaign_id=campaign_id)
+                return True
+        except Exception as e:
+            print(f"Error archiving campaign: {e}")
+            return False
+
 # User database operations
 async def register_user(telegram_id, full_name, phone_number):
     """Register a new user or update existing user"""
@@ -64,18 +606,20 @@ async def register_user(telegram_id, full_name, phone_number):
                 ON CONFLICT (telegram_id) 
                 DO UPDATE SET full_name = $2, phone_number = $3
             ''', telegram_id, full_name, phone_number)
+            await _publish(conn, 'user_updated', telegram_id=telegram_id)
             return True
         except Exception as e:
             print(f"Error registering user: {e}")
             return False
 
 async def get_user(telegram_id):
-    """Get user by telegram ID"""
+    """Get user by telegram ID, with whether they are blocked right now"""
     pool = await get_pool()
     
     async with pool.acquire() as conn:
         return await conn.fetchrow('''
-            SELECT * FROM users WHERE telegram_id = $1
+            SELECT *, COALESCE(blocked_until > CURRENT_TIMESTAMP, FALSE) as is_blocked
+            FROM users WHERE telegram_id = $1
         ''', telegram_id)
 
 async def update_wrong_attempts(telegram_id, attempts=None, block=False):
@@ -95,161 +639,397 @@ async def update_wrong_attempts(telegram_id, attempts=None, block=False):
                 UPDATE users SET blocked_until = to_timestamp($1)
                 WHERE telegram_id = $2
             ''', blocked_until, telegram_id)
+            await _publish(conn, 'user_updated', telegram_id=telegram_id)
 
-async def is_user_blocked(telegram_id):
-    """Check if user is currently blocked"""
+async def increment_wrong_attempts(telegram_id, count=1):
+    """Atomically add wrong attempts and return the new count"""
     pool = await get_pool()
     
     async with pool.acquire() as conn:
-        result = await conn.fetchval('''
-            SELECT blocked_until > CURRENT_TIMESTAMP as is_blocked
-            FROM users WHERE telegram_id = $1
+        attempts = await conn.fetchval('''
+            UPDATE users SET wrong_attempts = wrong_attempts + $2
+            WHERE telegram_id = $1
+            RETURNING wrong_attempts
+        ''', telegram_id, count)
+        return attempts or count
+
+async def unblock_user(telegram_id):
+    """Lift a user's block and reset their wrong attempts"""
+    pool = await get_pool()
+    
+    async with pool.acquire() as conn:
+        updated = await conn.fetchval('''
+            UPDATE users SET blocked_until = NULL, wrong_attempts = 0
+            WHERE telegram_id = $1
+            RETURNING id
         ''', telegram_id)
-        return result or False
+        if updated:
+            await _publish(conn, 'user_updated', telegram_id=telegram_id)
+        return bool(updated)
 
-# Promocode database operations
-async def add_promocode(code):
-    """Add a new promocode to the database"""
+async def search_users(query, limit, offset=0, max_candidates=1000):
+    """Find users by part of their name, phone number or Telegram ID
+
+    A query of digits (spaces, '+', '-' and brackets allowed) matches phone
+    numbers containing it (from ``SEARCH_MIN_PHONE_DIGITS`` digits on) and
+    the exact Telegram ID; other text matches
+    names containing it or similar to it (trigram similarity). At most
+    ``max_candidates`` matches are ranked, which keeps very common queries
+    as fast as rare ones. Returns ``(rows, total)`` where ``total`` counts
+    the ranked matches.
+    """
+    query = query.strip()
+    digits = re.sub(r"[\s+()-]", "", query)
+    # LIKE wildcards typed by the admin are matched literally
+    pattern = '%' + re.sub(r"([\\%_])", r"\\\1", query) + '%'
+    
+    if digits.isdigit():
+        phone_match = "phone_norm LIKE '%' || $1 || '%' OR" if len(digits) >= SEARCH_MIN_PHONE_DIGITS else ""
+        sql = f'''
+            WITH candidates AS (
+                SELECT id FROM users
+                WHERE {phone_match} telegram_id = $2
+                LIMIT $3
+            )
+            SELECT u.telegram_id, u.full_name, u.phone_number, u.registered_at,
+                   u.blocked_until > CURRENT_TIMESTAMP as is_blocked,
+                   COUNT(*) OVER () as total
+            FROM candidates c JOIN users u ON u.id = c.id
+            ORDER BY u.telegram_id = $2 DESC, u.phone_norm = $1 DESC, u.id
+            LIMIT $4 OFFSET $5
+        '''
+        telegram_id = int(digits) if len(digits) <= 18 else 0
+        args = (digits, telegram_id, max_candidates, limit, offset)
+    else:
+        sql = '''
+            WITH candidates AS (
+                SELECT id FROM users
+                WHERE full_name ILIKE $1 OR full_name % $2
+                LIMIT $3
+            )
+            SELECT u.telegram_id, u.full_name, u.phone_number, u.registered_at,
+                   u.blocked_until > CURRENT_TIMESTAMP as is_blocked,
+                   COUNT(*) OVER () as total
+            FROM candidates c JOIN users u ON u.id = c.id
+            ORDER BY similarity(u.full_name, $2) DESC, u.id
+            LIMIT $4 OFFSET $5
+        '''
+        args = (pattern, query, max_candidates, limit, offset)
+    
+    rows = await _read('fetch', sql, *args, key=query)
+    return rows, rows[0]['total'] if rows else 0
+
+async def get_user_status(telegram_id):
+    """Get the seconds left of a user's block, or None if not registered"""
     pool = await get_pool()
     
     async with pool.acquire() as conn:
-        try:
-            await conn.execute('''
-                INSERT INTO promocodes (code, status) VALUES ($1, 'unused')
-            ''', code)
-            return True
-        except asyncpg.exceptions.UniqueViolationError:
-            # Code already exists
-            return False
-        except Exception as e:
-            print(f"Error adding promocode: {e}")
-            return False
+        return await conn.fetchval(USER_STATUS_SQL, telegram_id)
+
+# Promocode database operations
+async def add_promocode(code, campaign_id):
+    """Add a new promocode to the campaign; False if it already exists"""
+    return bool(await add_multiple_promocodes([code], campaign_id))
 
-async def add_multiple_promocodes(codes):
-    """Add multiple promocodes to the database"""
+async def add_multiple_promocodes(codes, campaign_id, on_progress=None, chunk_size=1000):
+    """Add multiple promocodes to the campaign
+
+    Codes that exist in any live campaign, also when spelled with other
+    confusable characters, are skipped: redemption looks codes up across
+    live campaigns, so such a code would be redeemable twice or ambiguous.
+    Returns the codes actually added, or None on error. ``on_progress`` is
+    called with the number of codes processed so far after every chunk; it
+    runs inside the transaction that holds the promocodes lock, so it only
+    records the number and must not wait for anything.
+    """
     pool = await get_pool()
+    added = []
     
     async with pool.acquire() as conn:
         try:
             # Using a transaction to ensure all or nothing
             async with conn.transaction():
-                for code in codes:
-                    await conn.execute('''
-                        INSERT INTO promocodes (code, status) 
-                        VALUES ($1, 'unused')
-                        ON CONFLICT (code) DO NOTHING
-                    ''', code)
-            return True
+                await conn.execute('SELECT pg_advisory_xact_lock($1)', PROMOCODES_LOCK_KEY)
+                for start in range(0, len(codes), chunk_size):
+                    chunk = codes[start:start + chunk_size]
+                    rows = await conn.fetch(f'''
+                        INSERT INTO promocodes (campaign_id, code, status)
+                        SELECT $1, c.code, 'unused'
+                        FROM (
+                            SELECT DISTINCT ON (norm) code, norm
+                            FROM (
+                                SELECT code, translate(code, '{CONFUSABLE_CHARS}', '{CANONICAL_CHARS}') as norm
+                                FROM unnest($2::text[]) AS t(code)
+                            ) t
+                        ) c
+                        WHERE NOT EXISTS (SELECT 1 FROM promocodes p WHERE p.code_norm = c.norm)
+                        RETURNING code
+                    ''', campaign_id, chunk)
+                    added += [row['code'] for row in rows]
+                    if on_progress:
+                        on_progress(start + len(chunk))
+                if added:
+                    await _publish(conn, 'codes_added', campaign_id=campaign_id, count=len(added))
+            return added
         except Exception as e:
             print(f"Error adding multiple promocodes: {e}")
-            return False
+            return None
 
-async def verify_promocode(code):
-    """Verify if promocode exists and is unused"""
+async def redeem_promocodes(codes, telegram_id):
+    """Verify and claim several promocodes for a user in one statement
+
+    Returns ``(results, wrong_attempts, redeemed_count)``: ``results`` lists
+    ``(code, outcome)`` in input order with outcome 'accepted', 'used' or
+    'wrong', ``wrong_attempts`` is the user's counter after this submission
+    (reset if any code was accepted, then increased by one per nonexistent
+    code), and ``redeemed_count`` is the user's total of redeemed codes.
+    Codes typed with confusable characters (O for 0, I for 1...) resolve to
+    the stored code when that is unambiguous. Returns None if the statement
+    failed.
+    """
     pool = await get_pool()
+    norms = [canonicalize_promocode(code) for code in codes]
     
     async with pool.acquire() as conn:
-        promocode = await conn.fetchrow('''
-            SELECT * FROM promocodes WHERE code = $1
-        ''', code)
-        
-        if not promocode:
-            return None  # Code doesn't exist
-        elif promocode['status'] == 'used':
-            return 'used'  # Code already used
+        try:
+            rows = await conn.fetch(REDEEM_PROMOCODES_SQL, codes, telegram_id, norms)
+            _note_write(telegram_id)
+        except Exception as e:
+            print(f"Error redeeming promocodes: {e}")
+            return None
+    
+    results = [(row['code'], row['outcome']) for row in rows]
+    wrong_attempts = rows[0]['wrong_attempts'] if rows else 0
+    redeemed_count = rows[0]['redeemed_count'] if rows else 0
+    return results, wrong_attempts or 0, redeemed_count or 0
+
+async def get_user_promocodes(telegram_id):
+    """Get all promocodes used by a user in active campaigns"""
+    return await _read('fetch', GET_USER_PROMOCODES_SQL, telegram_id,
+                       key=telegram_id, telegram_id=telegram_id)
+
+# Admin database operations
+# Campaign-scoped queries read the campaign's partition directly, which works
+# the same for live and archived (detached) campaigns
+async def get_total_confirmed_promocodes(campaign_id):
+    """Get total count of used promocodes in the campaign"""
+    return await _read('fetchval', f'''
+        SELECT COUNT(*) FROM {_partition('promocodes', campaign_id)} WHERE status = 'used'
+    ''', key=campaign_id)
+
+def _registered_users_query(campaign_id, where=""):
+    """Users and their submission counts as of a report watermark
+
+    $1 and $2 are the watermark's last user and submission IDs, so the rows
+    match the watermark they are cached under even if users register or
+    submit while the report is built.
+    """
+    return f'''
+        SELECT u.telegram_id, u.full_name, u.phone_number, u.registered_at,
+              COALESCE(c.promocode_count, 0) as promocode_count
+        FROM users u
+        LEFT JOIN (
+            SELECT user_id, COUNT(*) as promocode_count
+            FROM {_partition('user_promocodes', campaign_id)}
+            WHERE id <= COALESCE($2, 0)
+            GROUP BY user_id
+        ) c ON u.telegram_id = c.user_id
+        WHERE u.id <= COALESCE($1, 0) {where}
+        ORDER BY u.registered_at DESC
+    '''
+
+async def iter_registered_users(campaign_id, watermark, prefetch=5000):
+    """Stream registered users with their promocode count through a server-side cursor"""
+    async with _acquire_read(key=campaign_id) as conn:
+        async with conn.transaction():
+            async for user in conn.cursor(_registered_users_query(campaign_id), *watermark,
+                                          prefetch=prefetch):
+                yield user
+
+async def get_registered_users_since(campaign_id, last_user_id, watermark):
+    """Get users registered after the given users.id, with their promocode count"""
+    return await _read('fetch', _registered_users_query(campaign_id, "AND u.id > $3"),
+                       *watermark, last_user_id, key=campaign_id)
+
+async def get_users_report_watermark(campaign_id):
+    """Get a cheap change marker for the users report of a campaign
+
+    Both values are index-only MAX lookups on serial IDs: new registrations
+    move the first, new submissions in the campaign move the second. Edits of
+    existing user rows are not reflected. Read from the same replica as the
+    report itself, so a cached report is never older than its watermark.
+    """
+    row = await _read('fetchrow', f'''
+        SELECT (SELECT MAX(id) FROM users) as last_user_id,
+               (SELECT MAX(id) FROM {_partition('user_promocodes', campaign_id)}
+                WHERE campaign_id = $1) as last_submission_id
+    ''', campaign_id, key=campaign_id)
+    return [row['last_user_id'], row['last_submission_id']]
+
+async def get_random_winners(count, campaign_id):
+    """Select random winners from users who have submitted valid promocodes in the campaign"""
+    return await _read('fetch', f'''
+        SELECT u.telegram_id, u.full_name, u.phone_number, c.promocode_count
+        FROM (
+            SELECT user_id, COUNT(*) as promocode_count
+            FROM {_partition('user_promocodes', campaign_id)}
+            GROUP BY user_id
+        ) c
+        JOIN users u ON u.telegram_id = c.user_id
+        ORDER BY RANDOM()
+        LIMIT $1
+    ''', count, key=campaign_id)
+    
+async def get_redeemed_counts(since=None):
+    """Get users' redeemed code counts for the leaderboard
+
+    All users with any redeemed code, in the order they reached their count,
+    or only those whose count changed after ``since``. Returns
+    ``(rows, as_of)``, ``as_of`` being the database time before the read.
+    """
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        as_of = await conn.fetchval('SELECT LOCALTIMESTAMP')
+        if since is None:
+            rows = await conn.fetch('''
+                SELECT telegram_id, redeemed_count FROM users
+                WHERE redeemed_count > 0
+                ORDER BY redeemed_at
+            ''')
         else:
-            return 'valid'  # Code is valid
+            rows = await conn.fetch('''
+                SELECT telegram_id, redeemed_count FROM users
+                WHERE redeemed_at > $1
+                ORDER BY redeemed_at
+            ''', since)
+    return rows, as_of
 
-async def mark_promocode_used(code, telegram_id):
-    """Mark promocode as used and associate it with user"""
+async def get_users_by_ids(telegram_ids):
+    """Get name and phone number of the given users, keyed by telegram ID"""
+    rows = await _read('fetch', '''
+        SELECT telegram_id, full_name, phone_number FROM users
+        WHERE telegram_id = ANY($1::bigint[])
+    ''', list(telegram_ids))
+    return {row['telegram_id']: row for row in rows}
+
+# Job database operations
+async def create_job(kind, chat_id, params):
+    """Persist a new queued job and return its ID"""
     pool = await get_pool()
     
     async with pool.acquire() as conn:
-        try:
-            async with conn.transaction():
-                # Get promocode ID
-                promocode_id = await conn.fetchval('''
-                    SELECT id FROM promocodes WHERE code = $1
-                ''', code)
-                
-                if not promocode_id:
-                    return False
-                
-                # Mark promocode as used
-                await conn.execute('''
-                    UPDATE promocodes SET status = 'used' WHERE id = $1
-                ''', promocode_id)
-                
-                # Link promocode to user
-                await conn.execute('''
-                    INSERT INTO user_promocodes (user_id, promocode_id)
-                    VALUES ($1, $2)
-                ''', telegram_id, promocode_id)
-                
-                return True
-        except Exception as e:
-            print(f"Error marking promocode as used: {e}")
-            return False
+        return await conn.fetchval('''
+            INSERT INTO jobs (kind, chat_id, params)
+            VALUES ($1, $2, $3::jsonb)
+            RETURNING id
+        ''', kind, chat_id, json.dumps(params))
 
-async def get_user_promocodes(telegram_id):
-    """Get all promocodes used by a user"""
+async def get_job(job_id):
+    """Get job by ID with decoded params"""
+    pool = await get_pool()
+    
+    async with pool.acquire() as conn:
+        job = await conn.fetchrow('''
+            SELECT * FROM jobs WHERE id = $1
+        ''', job_id)
+    if job is None:
+        return None
+    job = dict(job)
+    job['params'] = json.loads(job['params'])
+    return job
+
+async def update_job(job_id, status=None, progress=None, message_id=None, error=None):
+    """Update job status, progress, status message or error"""
+    pool = await get_pool()
+    
+    async with pool.acquire() as conn:
+        await conn.execute('''
+            UPDATE jobs SET
+                status = COALESCE($2, status),
+                progress = COALESCE($3, progress),
+                message_id = COALESCE($4, message_id),
+                error = COALESCE($5, error),
+                finished_at = CASE WHEN $2 IN ('done', 'failed') THEN CURRENT_TIMESTAMP ELSE finished_at END
+            WHERE id = $1
+        ''', job_id, status, progress, message_id, error)
+
+async def claim_job(job_id):
+    """Move a queued job to running; returns False if someone else took it"""
+    pool = await get_pool()
+    
+    async with pool.acquire() as conn:
+        claimed = await conn.fetchval('''
+            UPDATE jobs SET status = 'running', started_at = CURRENT_TIMESTAMP
+            WHERE id = $1 AND status = 'queued'
+            RETURNING id
+        ''', job_id)
+        return claimed is not None
+
+async def fail_interrupted_jobs():
+    """Mark jobs left running by a previous process as failed and return them"""
     pool = await get_pool()
     
     async with pool.acquire() as conn:
         return await conn.fetch('''
-            SELECT p.code, up.submitted_at
-            FROM user_promocodes up
-            JOIN promocodes p ON up.promocode_id = p.id
-            WHERE up.user_id = $1
-            ORDER BY up.submitted_at DESC
-        ''', telegram_id)
+            UPDATE jobs SET status = 'failed', error = 'interrupted', finished_at = CURRENT_TIMESTAMP
+            WHERE status = 'running'
+            RETURNING id, kind, chat_id, message_id
+        ''')
 
-# Admin database operations
-async def get_total_confirmed_promocodes():
-    """Get total count of used promocodes"""
+async def get_queued_job_ids():
+    """Get IDs of jobs still waiting in the queue, oldest first"""
     pool = await get_pool()
     
     async with pool.acquire() as conn:
-        return await conn.fetchval('''
-            SELECT COUNT(*) FROM promocodes WHERE status = 'used'
+        rows = await conn.fetch('''
+            SELECT id FROM jobs WHERE status = 'queued' ORDER BY id
         ''')
+    return [row['id'] for row in rows]
 
-async def get_all_registered_users():
-    """Get all registered users with their promocode count"""
+# Submission attempt log operations
+async def create_attempts_partition(month_start, month_end):
+    """Create the submission_attempts partition for one month"""
     pool = await get_pool()
     
     async with pool.acquire() as conn:
-        return await conn.fetch('''
-            SELECT u.telegram_id, u.full_name, u.phone_number, u.registered_at,
-                  COUNT(up.id) as promocode_count
-            FROM users u
-            LEFT JOIN user_promocodes up ON u.telegram_id = up.user_id
-            GROUP BY u.telegram_id, u.full_name, u.phone_number, u.registered_at
-            ORDER BY u.registered_at DESC
+        await conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS submission_attempts_{month_start:%Y%m}
+            PARTITION OF submission_attempts
+            FOR VALUES FROM ('{month_start:%Y-%m-%d}') TO ('{month_end:%Y-%m-%d}')
         ''')
 
-async def get_random_winners(count=1):
-    """Select random winners from users who have submitted valid promocodes"""
+async def copy_submission_attempts(records):
+    """Bulk-insert (user_id, code_hash, outcome, attempted_at) records with COPY"""
     pool = await get_pool()
     
     async with pool.acquire() as conn:
-        return await conn.fetch('''
-            SELECT DISTINCT ON (u.telegram_id) 
-                u.telegram_id, u.full_name, u.phone_number, 
-                COUNT(up.id) OVER (PARTITION BY u.telegram_id) as promocode_count
-            FROM users u
-            JOIN user_promocodes up ON u.telegram_id = up.user_id
-            ORDER BY u.telegram_id, RANDOM()
-            LIMIT $1
-        ''', count)
+        await conn.copy_records_to_table(
+            'submission_attempts',
+            records=records,
+            columns=['user_id', 'code_hash', 'outcome', 'attempted_at']
+        )
+
+# Abuse report operations
+async def save_abuse_report(summary):
+    """Save an abuse detector summary for the admin panel"""
+    pool = await get_pool()
     
-async def is_user_registered(telegram_id):
-    """Check if a user is already registered"""
+    async with pool.acquire() as conn:
+        await conn.execute('''
+            INSERT INTO abuse_reports (summary) VALUES ($1::jsonb)
+        ''', json.dumps(summary))
+
+async def get_abuse_reports(limit=5):
+    """Get the latest abuse reports with decoded summaries"""
     pool = await get_pool()
+    
     async with pool.acquire() as conn:
-        result = await conn.fetchval('''
-            SELECT EXISTS (
-                SELECT 1 FROM users WHERE telegram_id = $1
-            )
-        ''', telegram_id)
-    return result
\ No newline at end of file
+        rows = await conn.fetch('''
+            SELECT summary, created_at FROM abuse_reports
+            ORDER BY id DESC
+            LIMIT $1
+        ''', limit)
+    return [
+        {'summary': json.loads(row['summary']), 'created_at': row['created_at']}
+        for row in rows
+    ]
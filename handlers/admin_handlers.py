@@ -1,15 +1,27 @@
+import asyncio
+import re
+
 from aiogram import Dispatcher, Bot, F
 from aiogram.types import Message, CallbackQuery, KeyboardButton, ReplyKeyboardMarkup
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
-from aiogram.types import FSInputFile
+from aiogram.types import BufferedInputFile
 
 from models import AdminForm
-from config_admin import ADMIN_USERNAME, ADMIN_PASSWORD
-from db import get_total_confirmed_promocodes, get_all_registered_users
-from db import add_multiple_promocodes, get_random_winners
+from config_admin import ADMIN_USERNAME, ADMIN_PASSWORD, PROMOCODE_ALPHABET
+from config_admin import SEARCH_PAGE_SIZE, SEARCH_MAX_CANDIDATES, LEADERBOARD_TOP_N
+from db import get_total_confirmed_promocodes
+from db import add_multiple_promocodes, get_random_winners, iter_registered_users
+from db import get_registered_users_since, get_users_report_watermark, get_abuse_reports
+from db import create_campaign, get_campaigns, get_campaign, get_latest_active_campaign, archive_campaign
+from db import SEARCH_MIN_PHONE_DIGITS, search_users, get_user, get_user_promocodes, unblock_user, get_users_by_ids
 from utils.promocode_generator import generate_promocodes
-from utils.excel_export import export_users_to_excel, export_promocodes_to_excel, export_winners_to_excel
+from utils.export_writers import USERS_TABLE, PROMOCODES_TABLE, WINNERS_TABLE, EXPORT_FORMATS, export_parts
+from utils.jobs import JobRunner, JobContext, JobFailed, PROGRESS_EDIT_INTERVAL
+from utils.report_cache import report_cache
+from utils.leaderboard import leaderboard
 
 # Admin menu keyboard
 def get_admin_menu_keyboard():
@@ -19,6 +31,11 @@ def get_admin_menu_keyboard():
             [KeyboardButton(text="📊 Ro'yxatdan o'tganlar soni (Excel)")],
             [KeyboardButton(text="🎁 Promo kodlar yaratish")],
             [KeyboardButton(text="🏆 G'olibni aniqlash")],
+            [KeyboardButton(text="🗂 Kampaniyalar")],
+            [KeyboardButton(text="⚙️ Eksport formati")],
+            [KeyboardButton(text="🚨 Shubhali faollik")],
+            [KeyboardButton(text="🔎 Foydalanuvchi qidirish")],
+            [KeyboardButton(text="🏆 Reyting")],
             [KeyboardButton(text="🔙 Chiqish")]
         ],
         resize_keyboard=True
@@ -33,12 +50,87 @@ def get_back_keyboard():
     )
     return keyboard
 
+# Campaign menu keyboard
+def get_campaign_menu_keyboard():
+    keyboard = ReplyKeyboardMarkup(
+        keyboard=[
+            [KeyboardButton(text="➕ Yangi kampaniya")],
+            [KeyboardButton(text="🔀 Kampaniyani tanlash")],
+            [KeyboardButton(text="📦 Kampaniyani arxivlash")],
+            [KeyboardButton(text="🔙 Orqaga qaytish")]
+        ],
+        resize_keyboard=True
+    )
+    return keyboard
+
+# Export format keyboard
+def get_export_format_keyboard():
+    keyboard = ReplyKeyboardMarkup(
+        keyboard=[
+            [KeyboardButton(text=fmt.upper()) for fmt in EXPORT_FORMATS],
+            [KeyboardButton(text="🔙 Orqaga qaytish")]
+        ],
+        resize_keyboard=True
+    )
+    return keyboard
+
+# Search results keyboard: one button per user, then page navigation
+def get_search_keyboard(rows, page, total):
+    buttons = [
+        [InlineKeyboardButton(text=f"👤 {row['full_name'][:40]}", callback_data=f"search:user:{row['telegram_id']}")]
+        for row in rows
+    ]
+    navigation = []
+    if page > 0:
+        navigation.append(InlineKeyboardButton(text="◀️", callback_data=f"search:page:{page - 1}"))
+    if (page + 1) * SEARCH_PAGE_SIZE < total:
+        navigation.append(InlineKeyboardButton(text="▶️", callback_data=f"search:page:{page + 1}"))
+    if navigation:
+        buttons.append(navigation)
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+# User card keyboard
+def get_user_card_keyboard(user, page):
+    buttons = []
+    if user['is_blocked']:
+        buttons.append([InlineKeyboardButton(
+            text="🔓 Blokdan chiqarish", callback_data=f"search:unblock:{user['telegram_id']}"
+        )])
+    buttons.append([InlineKeyboardButton(text="🔙 Natijalarga qaytish", callback_data=f"search:page:{page}")])
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
 import logging
 
 
+async def get_current_campaign(state: FSMContext):
+    """Get the campaign the admin is working with, defaulting to the newest active one"""
+    data = await state.get_data()
+    campaign = None
+    if data.get('campaign_id'):
+        campaign = await get_campaign(data['campaign_id'])
+    if campaign is None:
+        campaign = await get_latest_active_campaign()
+        if campaign is None:
+            # Every campaign is archived; fall back to the newest one
+            campaign = (await get_campaigns())[0]
+        await state.update_data(campaign_id=campaign['id'])
+    return campaign
+
+async def get_export_format(state: FSMContext):
+    """Get the export format chosen by the admin"""
+    data = await state.get_data()
+    return data.get('export_format', 'xlsx')
+
+async def clear_session(state: FSMContext):
+    """End the admin session, keeping the chosen export format"""
+    fmt = (await state.get_data()).get('export_format')
+    await state.clear()
+    if fmt:
+        await state.update_data(export_format=fmt)
+
 async def cmd_admin(message: Message, state: FSMContext):
     """Handle /admin command"""
-    await state.clear()
+    await clear_session(state)
     await message.answer("Admin login kiriting:")
     await state.set_state(AdminForm.waiting_for_login)
 
@@ -63,32 +155,26 @@ async def process_password(message: Message, state: FSMContext):
     else:
         await message.answer("Noto'g'ri parol. Qayta urinib ko'ring:")
 
-async def admin_menu_handler(message: Message, state: FSMContext, bot: Bot):
+async def admin_menu_handler(message: Message, state: FSMContext, bot: Bot, job_runner: JobRunner):
     """Handle admin menu options"""
     if message.text == "📈 Tasdiqlangan kodlar soni":
-        count = await get_total_confirmed_promocodes()
-        await message.answer(f"Tasdiqlangan kodlar soni: {count}")
+        campaign = await get_current_campaign(state)
+        count = await get_total_confirmed_promocodes(campaign['id'])
+        await message.answer(f"Tasdiqlangan kodlar soni ({campaign['name']}): {count}")
     
     elif message.text == "📊 Ro'yxatdan o'tganlar soni (Excel)":
-        users = await get_all_registered_users()
+        campaign = await get_current_campaign(state)
+        fmt = await get_export_format(state)
+        watermark = await get_users_report_watermark(campaign['id'])
         
-        if users:
-            # Generate Excel file
-            excel_file = await export_users_to_excel(users)
-            
-            # Save to temporary file and send
-            with open("users.xlsx", "wb") as f:
-                f.write(excel_file.getvalue())
-            
-            # Send file to admin
-            doc = FSInputFile("users.xlsx")
-            await bot.send_document(
-                message.chat.id,
-                document=doc,
-                caption=f"Ro'yxatdan o'tgan foydalanuvchilar soni: {len(users)}"
-            )
+        # Nothing changed since the last export: re-send the uploaded files
+        cached = report_cache.get_fresh(('users', campaign['id'], fmt), watermark)
+        if cached:
+            for file_id, caption in cached.documents:
+                await bot.send_document(message.chat.id, document=file_id, caption=caption)
         else:
-            await message.answer("Hali foydalanuvchilar ro'yxatdan o'tishmagan.")
+            await job_runner.enqueue('export_users', message.chat.id, campaign_id=campaign['id'],
+                                     format=fmt, watermark=watermark)
     
     elif message.text == "🎁 Promo kodlar yaratish":
         await message.answer(
@@ -104,6 +190,30 @@ async def admin_menu_handler(message: Message, state: FSMContext, bot: Bot):
         )
         await state.set_state(AdminForm.waiting_for_winner_count)
     
+    elif message.text == "🗂 Kampaniyalar":
+        await show_campaigns(message, state)
+    
+    elif message.text == "⚙️ Eksport formati":
+        await message.answer(
+            f"Joriy format: {(await get_export_format(state)).upper()}\n"
+            f"Yangi formatni tanlang:",
+            reply_markup=get_export_format_keyboard()
+        )
+        await state.set_state(AdminForm.waiting_for_export_format)
+    
+    elif message.text == "🚨 Shubhali faollik":
+        await show_abuse_reports(message)
+    
+    elif message.text == "🏆 Reyting":
+        await show_leaderboard(message)
+    
+    elif message.text == "🔎 Foydalanuvchi qidirish":
+        await message.answer(
+            "Ism, telefon raqam yoki Telegram ID (kamida 3 ta belgi) kiriting:",
+            reply_markup=get_back_keyboard()
+        )
+        await state.set_state(AdminForm.waiting_for_search_query)
+    
     elif message.text == "🔙 Chiqish":
         await message.answer(
             "Admin paneldan chiqildi.",
@@ -112,9 +222,9 @@ async def admin_menu_handler(message: Message, state: FSMContext, bot: Bot):
                 resize_keyboard=True
             )
         )
-        await state.clear()
+        await clear_session(state)
 
-async def process_promocode_count(message: Message, state: FSMContext, bot: Bot):
+async def process_promocode_count(message: Message, state: FSMContext, job_runner: JobRunner):
     """Process promocode generation count"""
     if message.text == "🔙 Orqaga qaytish":
         await message.answer(
@@ -133,39 +243,25 @@ async def process_promocode_count(message: Message, state: FSMContext, bot: Bot)
             )
             return
         
-        # Generate promocodes
-        promocodes = generate_promocodes(count)
-        
-        # Add promocodes to database
-        success = await add_multiple_promocodes(promocodes)
-        
-        if success:
-            # Generate Excel file
-            excel_file = await export_promocodes_to_excel(promocodes)
-            
-            # Save to temporary file and send
-            with open("promocodes.xlsx", "wb") as f:
-                f.write(excel_file.getvalue())
-            
-            # Send file to admin
-            doc = FSInputFile("promocodes.xlsx")
-            await bot.send_document(
-                message.chat.id,
-                document=doc,
-                caption=f"{count} ta promokod muvaffaqiyatli yaratildi."
-            )
-            
+        campaign = await get_current_campaign(state)
+        if campaign['status'] != 'active':
             await message.answer(
-                "Admin panel",
-                reply_markup=get_admin_menu_keyboard()
-            )
-            await state.set_state(AdminForm.admin_menu)
-        else:
-            await message.answer(
-                "Promokodlarni yaratishda xatolik yuz berdi. Iltimos qayta urinib ko'ring.",
+                "Arxivlangan kampaniyaga promokod qo'shib bo'lmaydi.",
                 reply_markup=get_admin_menu_keyboard()
             )
             await state.set_state(AdminForm.admin_menu)
+            return
+        
+        # Generation, insert and upload run in the background
+        await job_runner.enqueue('generate_promocodes', message.chat.id,
+                                 count=count, campaign_id=campaign['id'],
+                                 format=await get_export_format(state))
+        
+        await message.answer(
+            "Admin panel",
+            reply_markup=get_admin_menu_keyboard()
+        )
+        await state.set_state(AdminForm.admin_menu)
     
     except ValueError:
         await message.answer(
@@ -173,7 +269,7 @@ async def process_promocode_count(message: Message, state: FSMContext, bot: Bot)
             reply_markup=get_back_keyboard()
         )
 
-async def process_winner_count(message: Message, state: FSMContext, bot: Bot):
+async def process_winner_count(message: Message, state: FSMContext, job_runner: JobRunner):
     """Process winner selection count"""
     if message.text == "🔙 Orqaga qaytish":
         await message.answer(
@@ -192,40 +288,10 @@ async def process_winner_count(message: Message, state: FSMContext, bot: Bot):
             )
             return
         
-        # Select random winners
-        winners = await get_random_winners(count)
-        
-        if winners and len(winners) > 0:
-            # Format winners list for message
-            winners_text = "\n".join([
-                f"{i+1}. {winner['full_name']} - {winner['phone_number']} "
-                f"({winner['promocode_count']} ta promokod)"
-                for i, winner in enumerate(winners)
-            ])
-            
-            await message.answer(
-                f"G'oliblar ro'yxati:\n\n{winners_text}"
-            )
-            
-            # Generate Excel file
-            excel_file = await export_winners_to_excel(winners)
-            
-            # Save to temporary file and send
-            with open("winners.xlsx", "wb") as f:
-                f.write(excel_file.getvalue())
-            
-            # Send file to admin
-            doc = FSInputFile("winners.xlsx")
-            await bot.send_document(
-                message.chat.id,
-                document=doc,
-                caption=f"{len(winners)} ta g'olib aniqlandi."
-            )
-        else:
-            await message.answer(
-                "G'oliblarni aniqlashda xatolik yuz berdi yoki promokodi tasdiqlangan "
-                "foydalanuvchilar yo'q."
-            )
+        campaign = await get_current_campaign(state)
+        await job_runner.enqueue('select_winners', message.chat.id,
+                                 count=count, campaign_id=campaign['id'],
+                                 format=await get_export_format(state))
         
         await message.answer(
             "Admin panel:",
@@ -239,7 +305,368 @@ async def process_winner_count(message: Message, state: FSMContext, bot: Bot):
             reply_markup=get_back_keyboard()
         )
 
+async def show_abuse_reports(message: Message):
+    """Show the latest summaries saved by the user bot's abuse detector"""
+    reports = await get_abuse_reports()
+    if not reports:
+        await message.answer("Shubhali faollik aniqlanmadi.")
+        return
+    
+    blocks = []
+    for report in reports:
+        summary = report['summary']
+        lines = [
+            f"🕒 {report['created_at'].strftime('%Y-%m-%d %H:%M')} "
+            f"(oxirgi {summary['window_seconds'] // 60} daqiqa)",
+            f"Xato urinishlar: {summary['wrong_attempts']}"
+            f"{' — umumiy hujum!' if summary['global_burst'] else ''}",
+            f"Cheklangan so'rovlar: {summary['throttled']}",
+        ]
+        if summary['phones']:
+            lines.append("Telefonlar: " + ", ".join(
+                f"{phone} ({count})" for phone, count in summary['phones']
+            ))
+        if summary['prefixes']:
+            lines.append("Kod boshlanishlari: " + ", ".join(
+                f"{prefix}… ({count})" for prefix, count in summary['prefixes']
+            ))
+        blocks.append("\n".join(lines))
+    
+    await message.answer("🚨 Shubhali faollik:\n\n" + "\n\n".join(blocks))
+
+async def show_leaderboard(message: Message):
+    """Show the users with most redeemed codes across all campaigns"""
+    if not leaderboard.loaded:
+        await message.answer("Reyting tayyorlanmoqda. Iltimos birozdan so'ng qayta urinib ko'ring.")
+        return
+    
+    top = leaderboard.top(LEADERBOARD_TOP_N)
+    if not top:
+        await message.answer("Hali hech kim promokod kiritmagan.")
+        return
+    
+    users = await get_users_by_ids(telegram_id for telegram_id, _, _ in top)
+    lines = [f"🏆 Reyting ({len(leaderboard)} ta foydalanuvchi promokod kiritgan):", ""]
+    for telegram_id, count, rank in top:
+        user = users.get(telegram_id)
+        details = f"{user['full_name']} — {user['phone_number']}" if user else "—"
+        lines.append(f"{rank}. {details} (ID: {telegram_id}): {count} ta")
+    await message.answer("\n".join(lines))
+
+async def render_search_page(query, page):
+    """Text and keyboard of one page of search results"""
+    rows, total = await search_users(query, SEARCH_PAGE_SIZE, page * SEARCH_PAGE_SIZE, SEARCH_MAX_CANDIDATES)
+    if not rows:
+        return f"🔎 \"{query}\" bo'yicha hech kim topilmadi.", None
+    
+    pages = (total + SEARCH_PAGE_SIZE - 1) // SEARCH_PAGE_SIZE
+    more = "+" if total >= SEARCH_MAX_CANDIDATES else ""
+    lines = [f"🔎 \"{query}\": {total}{more} ta natija (sahifa {page + 1}/{pages})", ""]
+    for i, row in enumerate(rows, start=page * SEARCH_PAGE_SIZE + 1):
+        lines.append(
+            f"{i}. {'⛔ ' if row['is_blocked'] else ''}{row['full_name']} — "
+            f"{row['phone_number']} (ID: {row['telegram_id']})"
+        )
+    if more:
+        lines.append("\nNatijalar juda ko'p, so'rovni aniqroq yozing.")
+    return "\n".join(lines), get_search_keyboard(rows, page, total)
 
+async def render_user_card(telegram_id, page):
+    """Text and keyboard with a user's details, block status and promocodes"""
+    user = await get_user(telegram_id)
+    if user is None:
+        return "Foydalanuvchi topilmadi.", None
+    promocodes = await get_user_promocodes(telegram_id)
+    
+    lines = [
+        f"👤 {user['full_name']}",
+        f"📱 {user['phone_number']}",
+        f"🆔 {user['telegram_id']}",
+        f"📅 Ro'yxatdan o'tgan: {user['registered_at'].strftime('%Y-%m-%d %H:%M')}",
+        f"⛔ Bloklangan: {user['blocked_until'].strftime('%Y-%m-%d %H:%M')} gacha"
+        if user['is_blocked'] else "✅ Bloklanmagan",
+        f"❌ Ketma-ket xato urinishlar: {user['wrong_attempts']}",
+        "",
+        f"🎟 Promokodlar ({len(promocodes)}):",
+    ]
+    # Keep the card well under Telegram's message length limit
+    shown = promocodes[:30]
+    lines += [
+        f"{i}. {code['code']} - {code['submitted_at'].strftime('%Y-%m-%d %H:%M')}"
+        for i, code in enumerate(shown, start=1)
+    ]
+    if len(promocodes) > len(shown):
+        lines.append(f"... va yana {len(promocodes) - len(shown)} ta")
+    return "\n".join(lines), get_user_card_keyboard(user, page)
+
+async def process_search_query(message: Message, state: FSMContext):
+    """Search users by name, phone number or Telegram ID"""
+    if message.text == "🔙 Orqaga qaytish":
+        await message.answer(
+            "Admin panel:",
+            reply_markup=get_admin_menu_keyboard()
+        )
+        await state.set_state(AdminForm.admin_menu)
+        return
+    
+    query = (message.text or "").strip()[:100]
+    if len(query) < 3:
+        await message.answer("Iltimos kamida 3 ta belgi kiriting.")
+        return
+    digits = re.sub(r"[\s+()-]", "", query)
+    if digits.isdigit() and len(digits) < SEARCH_MIN_PHONE_DIGITS:
+        await message.answer(f"Telefon raqami bo'yicha qidirish uchun kamida {SEARCH_MIN_PHONE_DIGITS} ta raqam kiriting.")
+        return
+    
+    await state.update_data(search_query=query, search_page=0)
+    text, keyboard = await render_search_page(query, 0)
+    await message.answer(text, reply_markup=keyboard)
+
+async def search_callback(callback: CallbackQuery, state: FSMContext):
+    """Page through search results, open a user card or lift a block"""
+    _, action, value = callback.data.split(":")
+    data = await state.get_data()
+    page = data.get('search_page', 0)
+    
+    if action == "page":
+        if not data.get('search_query'):
+            await callback.answer("Qidiruvni qaytadan boshlang.")
+            return
+        page = int(value)
+        await state.update_data(search_page=page)
+        text, keyboard = await render_search_page(data['search_query'], page)
+    else:
+        if action == "unblock":
+            await unblock_user(int(value))
+        text, keyboard = await render_user_card(int(value), page)
+    
+    try:
+        await callback.message.edit_text(text, reply_markup=keyboard)
+    except TelegramBadRequest:
+        # Nothing changed since the last render
+        pass
+    await callback.answer()
+
+async def process_export_format(message: Message, state: FSMContext):
+    """Save the export format chosen by the admin"""
+    fmt = (message.text or "").lower()
+    if fmt in EXPORT_FORMATS:
+        await state.update_data(export_format=fmt)
+        await message.answer(f"Eksport formati: {fmt.upper()}")
+    elif message.text != "🔙 Orqaga qaytish":
+        await message.answer(
+            "Iltimos formatni tugmalar orqali tanlang.",
+            reply_markup=get_export_format_keyboard()
+        )
+        return
+    
+    await message.answer(
+        "Admin panel:",
+        reply_markup=get_admin_menu_keyboard()
+    )
+    await state.set_state(AdminForm.admin_menu)
+
+# Background jobs
+async def send_export(job: JobContext, table, records, caption, empty_text=None,
+                      cache_key=None, watermark=None):
+    """Yield the export in the job's format as documents, one per size-bounded part
+
+    With ``cache_key`` the uploaded documents and source records are stored
+    in the report cache under the given watermark.
+    """
+    rows = []
+    if cache_key:
+        records = report_cache.collect(records, rows)
+    
+    sent = False
+    async for part in export_parts(table, records, job.params.get('format', 'xlsx')):
+        sent = True
+        yield (
+            BufferedInputFile(part.data, filename=part.filename),
+            f"{caption} ({part.filename}: {part.rows} ta qator)"
+        )
+    if not sent and empty_text:
+        await job.runner.bot.send_message(job.chat_id, empty_text)
+    
+    if cache_key and job.sent_documents:
+        report_cache.put(cache_key, watermark, list(job.sent_documents), rows)
+
+async def export_users_job(job: JobContext):
+    """Build the registered users export, reusing cached rows when only new users appeared"""
+    campaign_id = job.params['campaign_id']
+    watermark = job.params.get('watermark') or await get_users_report_watermark(campaign_id)
+    cache_key = ('users', campaign_id, job.params.get('format', 'xlsx'))
+    
+    cached = report_cache.get(cache_key)
+    if cached and cached.rows is not None and cached.watermark[1] == watermark[1]:
+        # No new submissions, so cached counts are current; fetch only new users
+        await job.progress("Yangi foydalanuvchilar qo'shilmoqda", force=True)
+        new_users = await get_registered_users_since(campaign_id, cached.watermark[0] or 0, watermark)
+        records = list(new_users) + cached.rows
+    else:
+        await job.progress("Foydalanuvchilar eksport qilinmoqda", force=True)
+        records = iter_registered_users(campaign_id, watermark)
+    
+    return send_export(
+        job, USERS_TABLE, records,
+        "Ro'yxatdan o'tgan foydalanuvchilar",
+        empty_text="Hali foydalanuvchilar ro'yxatdan o'tishmagan.",
+        cache_key=cache_key, watermark=watermark
+    )
+
+# Generation rounds before giving up on replacing codes that already exist
+GENERATE_ROUNDS = 5
+
+async def generate_promocodes_job(job: JobContext):
+    """Generate promocodes, store them and deliver the export"""
+    count = job.params['count']
+    promocodes = []
+    processed = 0  # Codes of the current batch the insert went through
+    
+    def on_progress(done):
+        nonlocal processed
+        processed = done
+    
+    async def report_progress():
+        # The insert holds the promocodes lock, so the status message and
+        # the jobs table are updated from here instead of from its callback
+        while True:
+            await asyncio.sleep(PROGRESS_EDIT_INTERVAL)
+            await job.progress("Promokodlar bazaga yozilmoqda",
+                               percent=(len(promocodes) + processed) * 100 // count)
+    
+    # Codes that already exist in a live campaign are skipped by the insert;
+    # generate replacements for them until the count is reached
+    for _ in range(GENERATE_ROUNDS):
+        written = len(promocodes)
+        if written == count:
+            break
+        await job.progress("Promokodlar yaratilmoqda", force=True)
+        batch = generate_promocodes(count - written, alphabet=PROMOCODE_ALPHABET)
+        
+        processed = 0
+        reporter = asyncio.create_task(report_progress())
+        try:
+            added = await add_multiple_promocodes(batch, job.params['campaign_id'], on_progress)
+        finally:
+            reporter.cancel()
+            await asyncio.gather(reporter, return_exceptions=True)
+        if added is None:
+            raise JobFailed("Promokodlarni yaratishda xatolik yuz berdi. Iltimos qayta urinib ko'ring.")
+        promocodes += added
+    
+    # Only codes that were stored go into the export
+    await job.progress("Fayl tayyorlanmoqda", force=True)
+    return send_export(job, PROMOCODES_TABLE, promocodes,
+                       f"{len(promocodes)} ta promokod muvaffaqiyatli yaratildi.")
+
+async def select_winners_job(job: JobContext):
+    """Draw random winners and deliver the list and export"""
+    await job.progress("G'oliblar aniqlanmoqda", force=True)
+    winners = await get_random_winners(job.params['count'], job.params['campaign_id'])
+    
+    if not winners:
+        raise JobFailed(
+            "G'oliblarni aniqlashda xatolik yuz berdi yoki promokodi tasdiqlangan "
+            "foydalanuvchilar yo'q."
+        )
+    
+    # Format winners list for message
+    winners_text = "\n".join([
+        f"{i+1}. {winner['full_name']} - {winner['phone_number']} "
+        f"({winner['promocode_count']} ta promokod)"
+        for i, winner in enumerate(winners)
+    ])
+    await job.runner.bot.send_message(job.chat_id, f"G'oliblar ro'yxati:\n\n{winners_text}")
+    
+    await job.progress("Fayl tayyorlanmoqda", force=True)
+    return send_export(job, WINNERS_TABLE, winners, f"{len(winners)} ta g'olib aniqlandi.")
+
+async def show_campaigns(message: Message, state: FSMContext):
+    """Show campaign list and the campaign menu"""
+    current = await get_current_campaign(state)
+    campaigns = await get_campaigns()
+    
+    campaigns_text = "\n".join([
+        f"{'👉 ' if current and campaign['id'] == current['id'] else ''}"
+        f"{campaign['id']}. {campaign['name']} "
+        f"({'faol' if campaign['status'] == 'active' else 'arxivlangan'})"
+        for campaign in campaigns
+    ])
+    await message.answer(
+        f"Kampaniyalar:\n\n{campaigns_text}",
+        reply_markup=get_campaign_menu_keyboard()
+    )
+    await state.set_state(AdminForm.campaign_menu)
+
+async def campaign_menu_handler(message: Message, state: FSMContext):
+    """Handle campaign menu options"""
+    if message.text == "➕ Yangi kampaniya":
+        await message.answer(
+            "Yangi kampaniya nomini kiriting:",
+            reply_markup=get_back_keyboard()
+        )
+        await state.set_state(AdminForm.waiting_for_campaign_name)
+    
+    elif message.text == "🔀 Kampaniyani tanlash":
+        await message.answer(
+            "Kampaniya raqamini kiriting:",
+            reply_markup=get_back_keyboard()
+        )
+        await state.set_state(AdminForm.waiting_for_campaign_id)
+    
+    elif message.text == "📦 Kampaniyani arxivlash":
+        campaign = await get_current_campaign(state)
+        if campaign and await archive_campaign(campaign['id']):
+            await message.answer(f"\"{campaign['name']}\" kampaniyasi arxivlandi.")
+        else:
+            await message.answer("Kampaniyani arxivlab bo'lmadi.")
+        await show_campaigns(message, state)
+    
+    elif message.text == "🔙 Orqaga qaytish":
+        await message.answer(
+            "Admin panel:",
+            reply_markup=get_admin_menu_keyboard()
+        )
+        await state.set_state(AdminForm.admin_menu)
+
+async def process_campaign_name(message: Message, state: FSMContext):
+    """Create a campaign with the given name and switch to it"""
+    if message.text == "🔙 Orqaga qaytish":
+        await show_campaigns(message, state)
+        return
+    
+    name = (message.text or "").strip()[:100]
+    if not name:
+        await message.answer("Iltimos kampaniya nomini kiriting.")
+        return
+    
+    campaign_id = await create_campaign(name)
+    if campaign_id:
+        await state.update_data(campaign_id=campaign_id)
+        await message.answer(f"\"{name}\" kampaniyasi yaratildi.")
+    else:
+        await message.answer("Kampaniyani yaratishda xatolik yuz berdi.")
+    await show_campaigns(message, state)
+
+async def process_campaign_id(message: Message, state: FSMContext):
+    """Switch the admin to another campaign"""
+    if message.text == "🔙 Orqaga qaytish":
+        await show_campaigns(message, state)
+        return
+    
+    try:
+        campaign = await get_campaign(int(message.text))
+    except ValueError:
+        await message.answer("Iltimos faqat son kiriting.")
+        return
+    
+    if campaign:
+        await state.update_data(campaign_id=campaign['id'])
+        await message.answer(f"Tanlangan kampaniya: {campaign['name']}")
+        await show_campaigns(message, state)
+    else:
+        await message.answer("Bunday kampaniya topilmadi.")
 
 def register_admin_handlers(dp: Dispatcher):
     """Register all admin handlers"""
@@ -249,3 +676,15 @@ def register_admin_handlers(dp: Dispatcher):
     dp.message.register(admin_menu_handler, AdminForm.admin_menu)
     dp.message.register(process_promocode_count, AdminForm.waiting_for_promocode_count)
     dp.message.register(process_winner_count, AdminForm.waiting_for_winner_count)
+    dp.message.register(campaign_menu_handler, AdminForm.campaign_menu)
+    dp.message.register(process_campaign_name, AdminForm.waiting_for_campaign_name)
+    dp.message.register(process_campaign_id, AdminForm.waiting_for_campaign_id)
+    dp.message.register(process_export_format, AdminForm.waiting_for_export_format)
+    dp.message.register(process_search_query, AdminForm.waiting_for_search_query)
+    dp.callback_query.register(search_callback, AdminForm.waiting_for_search_query, F.data.startswith("search:"))
+
+def register_admin_jobs(runner: JobRunner):
+    """Register background job handlers used by the admin panel"""
+    runner.register('export_users', export_users_job, heavy=True)
+    runner.register('generate_promocodes', generate_promocodes_job, heavy=True)
+    runner.register('select_winners', select_winners_job)
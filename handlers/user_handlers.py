@@ -1,15 +1,22 @@
+import re
+
 from aiogram import Dispatcher, Bot, F
 from aiogram.types import Message, CallbackQuery, KeyboardButton, ReplyKeyboardMarkup, ReplyKeyboardRemove
 from aiogram.types import Contact, InlineKeyboardMarkup, InlineKeyboardButton
-from aiogram.filters import Command
+from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
 
 
 from models import Form
-from config_user import CHANNEL_USERNAME, MAX_WRONG_ATTEMPTS
-from db import register_user, get_user, verify_promocode, mark_promocode_used, is_user_registered
-from db import get_user_promocodes, update_wrong_attempts, is_user_blocked
+from config_user import CHANNEL_USERNAME, MAX_WRONG_ATTEMPTS, MAX_CODES_PER_MESSAGE, LEADERBOARD_TOP_N
+from db import register_user, redeem_promocodes, increment_wrong_attempts
+from db import get_user_promocodes, update_wrong_attempts, get_users_by_ids
 from utils.channel_utils import check_subscription
+from utils.audit_log import attempt_log
+from utils.abuse_detector import abuse_detector
+from utils.caches import user_status, wrong_codes
+from utils.leaderboard import leaderboard
+from utils.promocode_generator import canonicalize_promocode, is_promocode_format, PROMOCODE_LENGTH
 
 # Keyboard for requesting contact
 def get_contact_keyboard():
@@ -25,7 +32,8 @@ def get_main_menu_keyboard():
     keyboard = ReplyKeyboardMarkup(
         keyboard=[
             [KeyboardButton(text="📥 Promokod kiritish")],
-            [KeyboardButton(text="📋 Mening promokodlarim")]
+            [KeyboardButton(text="📋 Mening promokodlarim")],
+            [KeyboardButton(text="🏆 Reyting")]
         ],
         resize_keyboard=True
     )
@@ -55,7 +63,7 @@ async def cmd_start(message: Message, state: FSMContext, bot: Bot):
     await state.clear()
 
     # Check if the user is already registered
-    user_exists = await is_user_registered(message.from_user.id)
+    user_exists = await user_status.is_registered(message.from_user.id)
     if user_exists:
         await message.answer(
             f"Assalomu alaykum, {message.from_user.first_name}! 👋\n\n"
@@ -89,6 +97,14 @@ async def process_phone(message: Message, state: FSMContext):
     if message.contact and message.contact.phone_number:
         phone_number = message.contact.phone_number
         
+        # Same phone registering from many accounts
+        if abuse_detector.observe_phone(phone_number):
+            await message.answer(
+                "Bu raqam bilan juda ko'p ro'yxatdan o'tishga urinildi. "
+                "Iltimos keyinroq qayta urinib ko'ring."
+            )
+            return
+        
         # Get full name from state
         user_data = await state.get_data()
         full_name = user_data.get('full_name')
@@ -102,6 +118,8 @@ async def process_phone(message: Message, state: FSMContext):
                 "Endi siz promokodlarni kiritishingiz mumkin.",
                 reply_markup=get_main_menu_keyboard()
             )
+            # The name is in the database now; don't keep a copy per user
+            await state.set_data({})
             await state.set_state(Form.main_menu)
         else:
             await message.answer(
@@ -118,7 +136,8 @@ async def main_menu_handler(message: Message, state: FSMContext):
     """Handle main menu options"""
     if message.text == "📥 Promokod kiritish":
         await message.answer(
-            "Promokodni kiriting:",
+            f"Promokodni kiriting (bir nechta kodni bo'sh joy yoki yangi qator bilan "
+            f"ajratib, {MAX_CODES_PER_MESSAGE} tagacha yuborishingiz mumkin):",
             reply_markup=get_back_keyboard()
         )
         await state.set_state(Form.waiting_for_promocode)
@@ -141,9 +160,75 @@ async def main_menu_handler(message: Message, state: FSMContext):
                 "Siz hali birorta ham promokod kiritmadingiz.",
                 reply_markup=get_main_menu_keyboard()
             )
+    
+    elif message.text == "🏆 Reyting":
+        await show_leaderboard(message)
+
+async def show_leaderboard(message: Message):
+    """Show the users with most redeemed codes and the user's own rank"""
+    if not leaderboard.loaded:
+        await message.answer(
+            "Reyting tayyorlanmoqda. Iltimos birozdan so'ng qayta urinib ko'ring.",
+            reply_markup=get_main_menu_keyboard()
+        )
+        return
+    
+    top = leaderboard.top(LEADERBOARD_TOP_N)
+    users = await get_users_by_ids(telegram_id for telegram_id, _, _ in top)
+    medals = {1: "🥇", 2: "🥈", 3: "🥉"}
+    lines = ["🏆 Eng ko'p promokod kiritganlar:", ""]
+    for telegram_id, count, rank in top:
+        user = users.get(telegram_id)
+        # Only the first name, other users' details stay private
+        name = user['full_name'].split()[0] if user and user['full_name'].split() else "Foydalanuvchi"
+        lines.append(f"{medals.get(rank, f'{rank}.')} {name} — {count} ta")
+    if not top:
+        lines.append("Hali hech kim promokod kiritmagan.")
+    
+    rank, count = leaderboard.rank(message.from_user.id)
+    lines.append("")
+    if rank is None:
+        lines.append("Siz hali reytingda yo'qsiz. Promokod kiriting!")
+    else:
+        lines.append(f"Sizning o'rningiz: {rank} ({count} ta promokod)")
+    await message.answer("\n".join(lines), reply_markup=get_main_menu_keyboard())
+
+async def stateless_message_handler(message: Message, state: FSMContext):
+    """Handle a message from a chat without state (expired, or lost on restart)"""
+    if not await user_status.is_registered(message.from_user.id):
+        await message.answer("Botdan foydalanish uchun /start buyrug'ini yuboring.")
+        return
+    
+    await state.set_state(Form.main_menu)
+    if message.text in ("📥 Promokod kiritish", "📋 Mening promokodlarim", "🏆 Reyting"):
+        await main_menu_handler(message, state)
+    else:
+        await message.answer("Asosiy menyu:", reply_markup=get_main_menu_keyboard())
+
+# Shown when a message contains tokens that can't be promocodes
+FORMAT_HINT = f"Promokod {PROMOCODE_LENGTH} ta lotin harfi va raqamdan iborat bo'ladi, masalan: KMPT3479."
+
+def parse_promocodes(text):
+    """Split a message into upper-cased codes, dropping repeats but keeping order
+
+    Returns ``(codes, malformed)``. Tokens that can't be a code (wrong length
+    or characters other than A-Z and 0-9), such as the words of a sentence,
+    go to ``malformed`` and are not looked up or counted as wrong attempts.
+    Spellings that differ only in confusable characters (O/0, I/1...) count
+    as repeats, since they are looked up as the same code.
+    """
+    codes, malformed = {}, []
+    for token in re.split(r"[\s,;]+", (text or "").upper()):
+        if not token:
+            continue
+        if is_promocode_format(token):
+            codes.setdefault(canonicalize_promocode(token), token)
+        elif token not in malformed:
+            malformed.append(token)
+    return list(codes.values()), malformed
 
 async def process_promocode(message: Message, state: FSMContext, bot: Bot):
-    """Process and verify promocode"""
+    """Process and verify one or several promocodes sent in one message"""
     if message.text == "🔙 Orqaga qaytish":
         await message.answer(
             "Asosiy menyu:",
@@ -152,77 +237,115 @@ async def process_promocode(message: Message, state: FSMContext, bot: Bot):
         await state.set_state(Form.main_menu)
         return
     
+    user_id = message.from_user.id
+    codes, malformed = parse_promocodes(message.text)
+    if not codes:
+        text = f"❌ Bu promokod emas. {FORMAT_HINT}" if malformed else "Promokodni kiriting:"
+        await message.answer(text, reply_markup=get_back_keyboard())
+        return
+    if len(codes) > MAX_CODES_PER_MESSAGE:
+        await message.answer(
+            f"Bitta xabarda ko'pi bilan {MAX_CODES_PER_MESSAGE} ta promokod yuborish mumkin.",
+            reply_markup=get_back_keyboard()
+        )
+        return
+    
     # Check if user is blocked
-    is_blocked = await is_user_blocked(message.from_user.id)
+    is_blocked = await user_status.is_blocked(user_id)
     if is_blocked:
+        for code in codes:
+            await attempt_log.log(user_id, code, 'blocked')
         await message.answer(
             "Siz vaqtincha bloklangansiz. Iltimos keyinroq urinib ko'ring.",
             reply_markup=get_back_keyboard()
         )
         return
     
-    # Verify promocode
-    promocode = message.text.strip().upper()
-    verification_result = await verify_promocode(promocode)
-    
-    if verification_result == 'valid':
-        # Mark promocode as used
-        success = await mark_promocode_used(promocode, message.from_user.id)
-        
-        if success:
-            # Reset wrong attempts
-            await update_wrong_attempts(message.from_user.id, 0)
-            
-            # Send success message and sticker
-            await message.answer(
-                "🎉 Kod muvaffaqiyatli qabul qilindi! 🎉",
-                reply_markup=get_back_keyboard()
-            )
-            
-            # Send congratulation sticker
-            await bot.send_sticker(
-                message.chat.id,
-                sticker="CAACAgIAAxkBAAELrQJlXFrYJOCCKQJ7AAGC7MtVJ3W8FQgAAvoZAALMWJhL-_6r7l5qmKk0BA"  # Replace with actual sticker ID
-            )
-        else:
-            await message.answer(
-                "Promokod kiritishda xatolik yuz berdi. Iltimos qayta urinib ko'ring.",
-                reply_markup=get_back_keyboard()
-            )
+    # Suspicious flows are answered without touching the database
+    if any(abuse_detector.should_throttle(user_id, code) for code in codes):
+        for code in codes:
+            await attempt_log.log(user_id, code, 'throttled')
+        await message.answer(
+            "⏳ Juda ko'p urinishlar. Iltimos birozdan so'ng qayta urinib ko'ring.",
+            reply_markup=get_back_keyboard()
+        )
+        return
     
-    elif verification_result == 'used':
+    # Codes already known not to exist only need counting
+    generation = wrong_codes.generation
+    if all(wrong_codes.is_wrong(code) for code in codes):
+        wrong_attempts = await increment_wrong_attempts(user_id, len(codes))
+        redeemed = [(code, 'wrong') for code in codes], wrong_attempts, None
+    else:
+        # Verify and claim all codes in one query
+        redeemed = await redeem_promocodes(codes, user_id)
+    if redeemed is None:
+        for code in codes:
+            await attempt_log.log(user_id, code, 'error')
         await message.answer(
-            "❌ Bu kod allaqachon ishlatilgan.",
+            "Promokod kiritishda xatolik yuz berdi. Iltimos qayta urinib ko'ring.",
             reply_markup=get_back_keyboard()
         )
+        return
     
-    else:  # None - code doesn't exist
-        # Get current wrong attempts
-        user = await get_user(message.from_user.id)
-        wrong_attempts = user['wrong_attempts'] + 1 if user else 1
-        
-        # Update wrong attempts count
-        await update_wrong_attempts(message.from_user.id, wrong_attempts)
-        
-        # Check if user should be blocked
-        if wrong_attempts >= MAX_WRONG_ATTEMPTS:
-            await update_wrong_attempts(message.from_user.id, 0, block=True)
-            await message.answer(
-                "⛔ Siz ketma-ket xato kiritishlar soni uchun bloklangansiz. "
-                "Bir soatdan so'ng qayta urinib ko'ring.",
-                reply_markup=get_back_keyboard()
-            )
-        elif wrong_attempts >= 3:
-            await message.answer(
-                f"❌ Xato kod. Agar siz yana {MAX_WRONG_ATTEMPTS - wrong_attempts} marta xato kiritsangiz, "
-                f"siz vaqtincha bloklangani bo'lasiz.",
-                reply_markup=get_back_keyboard()
-            )
+    results, wrong_attempts, redeemed_count = redeemed
+    accepted, used, wrong = [], [], []
+    for code, outcome in results:
+        await attempt_log.log(user_id, code, outcome)
+        if outcome == 'accepted':
+            accepted.append(code)
         else:
-            await message.answer(
-                "❌ Xato kod. Iltimos tekshirib qayta kiriting.",
-                reply_markup=get_back_keyboard()
-            )
+            abuse_detector.observe_wrong_code(user_id, code)
+            (used if outcome == 'used' else wrong).append(code)
+    
+    wrong_codes.add(wrong, generation)
+    if accepted:
+        leaderboard.update(user_id, redeemed_count)
+    
+    # Every nonexistent code counted as one wrong attempt
+    blocked = bool(wrong) and wrong_attempts >= MAX_WRONG_ATTEMPTS
+    if blocked:
+        await update_wrong_attempts(user_id, 0, block=True)
+        user_status.forget(user_id)
+    
+    if len(codes) == 1:
+        if accepted:
+            text = "🎉 Kod muvaffaqiyatli qabul qilindi! 🎉"
+        elif used:
+            text = "❌ Bu kod allaqachon ishlatilgan."
+        else:
+            text = "❌ Xato kod. Iltimos tekshirib qayta kiriting."
+    else:
+        lines = [f"✅ Qabul qilindi: {len(accepted)} ta"]
+        if used:
+            lines.append(f"❌ Allaqachon ishlatilgan: {', '.join(used)}")
+        if wrong:
+            lines.append(f"❌ Xato kodlar: {', '.join(wrong)}")
+        text = "\n".join(lines)
+    
+    if blocked:
+        text += (
+            "\n\n⛔ Siz ketma-ket xato kiritishlar soni uchun bloklangansiz. "
+            "Bir soatdan so'ng qayta urinib ko'ring."
+        )
+    elif wrong and wrong_attempts >= 3:
+        text += (
+            f"\n\nAgar siz yana {MAX_WRONG_ATTEMPTS - wrong_attempts} marta xato kiritsangiz, "
+            f"siz vaqtincha bloklangani bo'lasiz."
+        )
+    
+    if malformed:
+        shown = ", ".join(malformed[:5]) + (" ..." if len(malformed) > 5 else "")
+        text += f"\n\n⚠️ Promokod emas, hisobga olinmadi: {shown}\n{FORMAT_HINT}"
+    
+    await message.answer(text, reply_markup=get_back_keyboard())
+    
+    if accepted:
+        # Send congratulation sticker
+        await bot.send_sticker(
+            message.chat.id,
+            sticker="CAACAgIAAxkBAAELrQJlXFrYJOCCKQJ7AAGC7MtVJ3W8FQgAAvoZAALMWJhL-_6r7l5qmKk0BA"  # Replace with actual sticker ID
+        )
 
 def register_user_handlers(dp: Dispatcher):
     """Register all user handlers"""
@@ -231,4 +354,9 @@ def register_user_handlers(dp: Dispatcher):
     dp.message.register(process_name, Form.waiting_for_name)
     dp.message.register(process_phone, Form.waiting_for_phone, F.contact)
     dp.message.register(main_menu_handler, Form.main_menu)
-    dp.message.register(process_promocode, Form.waiting_for_promocode)
\ No newline at end of file
+    dp.message.register(process_promocode, Form.waiting_for_promocode)
+    # Last, and never for commands, so /admin still reaches the admin handlers in main.py
+    dp.message.register(
+        stateless_message_handler, StateFilter(None),
+        lambda message: not (message.text or "").startswith("/")
+    )
\ No newline at end of file
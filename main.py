@@ -1,13 +1,22 @@
 import asyncio
 import logging
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import BotCommand, Message
 
 from config import BOT_TOKEN
+from config_admin import JOB_WORKERS, HEAVY_JOB_CONCURRENCY
+from config_user import USER_LOCK_BACKEND, USER_LOCK_POOL_SIZE, FSM_STORAGE_TTL, FSM_STORAGE_MAX_ENTRIES
+from config_user import FLOOD_DEFAULT_LIMIT, FLOOD_STATE_LIMITS, FLOOD_NOTICE_WINDOW, RECORD_UPDATES_DIR
 from db import create_tables
+from middlewares import UserEventIsolation, FloodControlMiddleware, UpdateRecorder
 from handlers.user_handlers import register_user_handlers
-from handlers.admin_handlers import register_admin_handlers
+from handlers.admin_handlers import register_admin_handlers, register_admin_jobs
+from utils.jobs import JobRunner
+from utils.audit_log import attempt_log
+from utils.abuse_detector import abuse_detector
+from utils.event_bus import event_bus
+from utils.leaderboard import leaderboard
+from utils.fsm_storage import BoundedMemoryStorage
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -23,8 +32,25 @@ async def set_commands(bot: Bot):
 async def main():
     # Initialize bot and dispatcher
     bot = Bot(token=BOT_TOKEN)
-    storage = MemoryStorage()
-    dp = Dispatcher(storage=storage)
+    storage = BoundedMemoryStorage(FSM_STORAGE_TTL, FSM_STORAGE_MAX_ENTRIES)
+    job_runner = JobRunner(bot, workers=JOB_WORKERS, heavy_concurrency=HEAVY_JOB_CONCURRENCY)
+    # Serialize updates per user; the FSM state is read under the lock
+    isolation = UserEventIsolation(USER_LOCK_BACKEND, USER_LOCK_POOL_SIZE)
+    dp = Dispatcher(storage=storage, events_isolation=isolation, disable_fsm=True, job_runner=job_runner)
+    
+    # Optionally record raw updates for replay, before anything else runs
+    recorder = UpdateRecorder(RECORD_UPDATES_DIR, "bot") if RECORD_UPDATES_DIR else None
+    if recorder:
+        dp.update.outer_middleware(recorder)
+    
+    # Drop message floods before they wait for the per-user lock or reach
+    # any handler
+    dp.update.outer_middleware(
+        FloodControlMiddleware(dp.fsm, FLOOD_DEFAULT_LIMIT, FLOOD_STATE_LIMITS, FLOOD_NOTICE_WINDOW)
+    )
+    
+    # Read the FSM state under the per-user lock, after the middlewares above
+    dp.update.outer_middleware(dp.fsm)
     
     # Register all handlers
     register_user_handlers(dp)
@@ -33,6 +59,17 @@ async def main():
     # Create database tables if they don't exist
     await create_tables()
     
+    # Resume queued admin jobs and start the workers
+    register_admin_jobs(job_runner)
+    await job_runner.start()
+    
+    # Start the write-behind submission attempt log, the abuse detector and
+    # the event bus that keeps the user caches in sync
+    await attempt_log.start()
+    await abuse_detector.start()
+    await event_bus.start()
+    await leaderboard.start()
+    
     # Set bot commands
     await set_commands(bot)
     
@@ -41,6 +78,13 @@ async def main():
         logging.info("Bot started and polling...")
         await dp.start_polling(bot, skip_updates=True)
     finally:
+        await job_runner.stop()
+        await attempt_log.close()
+        await abuse_detector.close()
+        await event_bus.close()
+        await leaderboard.close()
+        if recorder:
+            recorder.close()
         await bot.session.close()
 
 if __name__ == "__main__":
@@ -4,9 +4,12 @@ from aiogram import Bot, Dispatcher
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import BotCommand
 
-from config_admin import BOT_TOKEN
+from config_admin import BOT_TOKEN, JOB_WORKERS, HEAVY_JOB_CONCURRENCY, RECORD_UPDATES_DIR
 from db import create_tables
-from handlers.admin_handlers import register_admin_handlers
+from handlers.admin_handlers import register_admin_handlers, register_admin_jobs
+from middlewares import UpdateRecorder
+from utils.jobs import JobRunner
+from utils.leaderboard import leaderboard
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -18,14 +21,42 @@ async def set_commands(bot: Bot):
     ]
     await bot.set_my_commands(commands)
 
-async def main():
-    # Initialize bot and dispatcher
-    bot = Bot(token=BOT_TOKEN)
+async def start_jobs(job_runner: JobRunner):
+    """Resume queued admin jobs and start the workers"""
+    register_admin_jobs(job_runner)
+    await job_runner.start()
+
+async def stop_jobs(job_runner: JobRunner):
+    await job_runner.stop()
+
+def create_dispatcher(bot: Bot, record_dir=RECORD_UPDATES_DIR):
+    """Dispatcher with the admin handlers and a job runner sending through ``bot``
+
+    Also used by benchmarks/replay_updates.py. Job workers run between the
+    dispatcher's startup and shutdown.
+    """
     storage = MemoryStorage()
-    dp = Dispatcher(storage=storage)
+    job_runner = JobRunner(bot, workers=JOB_WORKERS, heavy_concurrency=HEAVY_JOB_CONCURRENCY)
+    dp = Dispatcher(storage=storage, job_runner=job_runner)
+    dp.startup.register(start_jobs)
+    dp.shutdown.register(stop_jobs)
+    dp.startup.register(leaderboard.start)
+    dp.shutdown.register(leaderboard.close)
+    
+    # Record raw updates first, before anything can delay them
+    if record_dir:
+        recorder = UpdateRecorder(record_dir, "admin")
+        dp.update.outer_middleware(recorder)
+        dp.shutdown.register(recorder.close)
     
     # Register admin handlers
     register_admin_handlers(dp)
+    return dp
+
+async def main():
+    # Initialize bot and dispatcher
+    bot = Bot(token=BOT_TOKEN)
+    dp = create_dispatcher(bot)
         
     # Create database tables if they don't exist
     await create_tables()
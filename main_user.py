@@ -1,16 +1,34 @@
+import time
+
+# Taken before any other import so import time is part of the startup report
+STARTED_AT = time.perf_counter()
+
 import asyncio
 import logging
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import BotCommand
 
-from config_user import BOT_TOKEN
+from config_user import BOT_TOKEN, USER_LOCK_BACKEND, USER_LOCK_POOL_SIZE, READINESS_FILE
+from config_user import FSM_STORAGE_TTL, FSM_STORAGE_MAX_ENTRIES, FSM_STORAGE_REPORT_INTERVAL
+from config_user import FLOOD_DEFAULT_LIMIT, FLOOD_STATE_LIMITS, FLOOD_NOTICE_WINDOW, RECORD_UPDATES_DIR
 from db import create_tables
+from middlewares import UserEventIsolation, FirstUpdateMiddleware, FloodControlMiddleware, UpdateRecorder
 from handlers.user_handlers import register_user_handlers
+from utils.readiness import mark_ready, clear_ready
+from utils.audit_log import attempt_log
+from utils.abuse_detector import abuse_detector
+from utils.event_bus import event_bus
+from utils.leaderboard import leaderboard
+from utils.fsm_storage import BoundedMemoryStorage
+
+IMPORTED_AT = time.perf_counter()
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 
+# Background startup tasks, referenced so they aren't garbage collected
+background_tasks = set()
+
 # Command list for bot menu
 async def set_commands(bot: Bot):
     commands = [
@@ -18,21 +36,102 @@ async def set_commands(bot: Bot):
     ]
     await bot.set_my_commands(commands)
 
-async def main():
-    # Initialize bot and dispatcher
-    bot = Bot(token=BOT_TOKEN)
-    storage = MemoryStorage()
-    dp = Dispatcher(storage=storage)
+async def report_usage(dispatcher: Dispatcher):
+    """Periodically log FSM state memory and flood control counters"""
+    while True:
+        await asyncio.sleep(FSM_STORAGE_REPORT_INTERVAL)
+        usage = dispatcher.storage.memory_usage()
+        logging.info(
+            f"FSM storage: {usage['entries']} entries, ~{usage['bytes_per_entry']} B each, "
+            f"~{usage['total_bytes'] / 2**20:.1f} MiB total, "
+            f"{usage['expired']} expired, {usage['evicted']} evicted"
+        )
+        logging.info(f"Flood control: {dispatcher['flood_control'].counters()}")
+
+def run_in_background(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+async def on_startup(bot: Bot, dispatcher: Dispatcher, readiness_file: str):
+    """Signal readiness right before polling starts"""
+    # The command menu doesn't affect update handling, don't wait for it
+    run_in_background(set_commands(bot))
+    run_in_background(report_usage(dispatcher))
+    
+    await attempt_log.start()
+    await abuse_detector.start()
+    # Keeps the user status and wrong code caches in sync with other processes
+    await event_bus.start()
+    # Loads in the background, polling doesn't wait for it
+    await leaderboard.start()
+    mark_ready(readiness_file)
+    logging.info(f"Ready to poll after {(time.perf_counter() - STARTED_AT) * 1000:.0f} ms")
+
+async def on_shutdown(readiness_file: str):
+    clear_ready(readiness_file)
+    for task in list(background_tasks):
+        task.cancel()
+    # Write out buffered submission attempts before exiting
+    await attempt_log.close()
+    await abuse_detector.close()
+    await event_bus.close()
+    await leaderboard.close()
+
+def create_dispatcher(record_dir=RECORD_UPDATES_DIR, lock_backend=USER_LOCK_BACKEND,
+                      readiness_file=READINESS_FILE):
+    """Dispatcher with the user bot's storage, middlewares and handlers
+
+    Also used by benchmarks/replay_updates.py and benchmarks/user_lock_race.py,
+    so they exercise exactly what polling does. ``lock_backend=None`` leaves
+    updates of one user unserialized, for comparison only; an empty
+    ``readiness_file`` keeps startup from signalling readiness, so a
+    benchmark next to a running bot doesn't touch its file.
+    """
+    storage = BoundedMemoryStorage(FSM_STORAGE_TTL, FSM_STORAGE_MAX_ENTRIES)
+    # Serialize updates per user; the FSM state is read under the lock
+    isolation = UserEventIsolation(lock_backend, USER_LOCK_POOL_SIZE) if lock_backend else None
+    # The FSM middleware (and with it the lock) is registered below, after
+    # the middlewares that must not wait for the lock
+    dp = Dispatcher(storage=storage, events_isolation=isolation, disable_fsm=True)
+    dp["readiness_file"] = readiness_file
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
+    
+    # Record raw updates first, before anything can delay or drop them
+    if record_dir:
+        recorder = UpdateRecorder(record_dir, "user")
+        dp.update.outer_middleware(recorder)
+        dp.shutdown.register(recorder.close)
+    
+    # Report time to the first handled update
+    dp.update.outer_middleware(FirstUpdateMiddleware(STARTED_AT))
+    
+    # Drop message floods before they wait for the per-user lock or reach
+    # filters, handlers and DB queries
+    flood_control = FloodControlMiddleware(dp.fsm, FLOOD_DEFAULT_LIMIT, FLOOD_STATE_LIMITS, FLOOD_NOTICE_WINDOW)
+    dp["flood_control"] = flood_control
+    dp.update.outer_middleware(flood_control)
+    
+    # Read the FSM state under the per-user lock
+    dp.update.outer_middleware(dp.fsm)
     
     # Register user handlers
     register_user_handlers(dp)
+    return dp
+
+async def main():
+    logging.info(f"Imports took {(IMPORTED_AT - STARTED_AT) * 1000:.0f} ms")
+    
+    # Initialize bot and dispatcher
+    bot = Bot(token=BOT_TOKEN)
+    dp = create_dispatcher()
         
-    # Create database tables if they don't exist
+    # Opens and warms the connection pool; skips the DDL when the schema
+    # version is current
     await create_tables()
     
-    # Set bot commands
-    await set_commands(bot)
-    
     # Start polling
     try:
         logging.info("User bot started and polling...")
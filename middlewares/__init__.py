@@ -0,0 +1,4 @@
+from .user_lock import UserEventIsolation
+from .startup_timer import FirstUpdateMiddleware
+from .flood_control import FloodControlMiddleware
+from .update_recorder import UpdateRecorder
@@ -0,0 +1,122 @@
+import logging
+import time
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.exceptions import TelegramAPIError
+from aiogram.types import Update
+
+
+class _RateLimit:
+    """Token bucket per user, kept as one theoretical arrival time (GCRA)
+
+    Allows ``burst`` messages at once and ``rate`` per second after that. A
+    user whose arrival time has passed has a full bucket, so such entries
+    carry no information and are dropped by ``evict_idle``.
+    """
+
+    __slots__ = ("interval", "tolerance", "arrivals")
+
+    def __init__(self, rate, burst):
+        self.interval = 1 / rate
+        self.tolerance = (burst - 1) * self.interval
+        self.arrivals = {}  # user_id -> theoretical arrival time
+
+    def allow(self, user_id, now):
+        arrival = max(self.arrivals.get(user_id, now), now)
+        if arrival - now > self.tolerance:
+            return False
+        self.arrivals[user_id] = arrival + self.interval
+        return True
+
+    def evict_idle(self, now):
+        self.arrivals = {user_id: arrival for user_id, arrival in self.arrivals.items() if arrival > now}
+
+
+class FloodControlMiddleware(BaseMiddleware):
+    """Drop messages of users sending faster than their limit
+
+    Registered as an outer update middleware ahead of the dispatcher's FSM
+    middleware, so an excess message is dropped before it waits for the
+    per-user lock and before any filter, handler or DB query runs. ``fsm`` is
+    the dispatcher's FSM middleware (``dp.fsm``), used to find the state. The limit
+    can depend on the state: ``state_limits`` maps state names to
+    ``(rate, burst)``, other states use ``default_limit``. The state is read
+    from the storage directly, without the lock, so a message racing a state
+    change may be held to the previous state's limit. The user gets at most
+    one notice per ``notice_window`` seconds. Memory only holds users that
+    sent something within their last burst.
+    """
+
+    # Seconds between sweeps of users whose buckets have refilled
+    SWEEP_INTERVAL = 60
+
+    def __init__(self, fsm, default_limit, state_limits=None, notice_window=10, notice_text=None):
+        self.fsm = fsm  # The dispatcher's FSMContextMiddleware, to resolve states
+        self.default = _RateLimit(*default_limit)
+        self.by_state = {state: _RateLimit(*limit) for state, limit in (state_limits or {}).items()}
+        self.notice_window = notice_window
+        self.notice_text = notice_text or "⏳ Juda ko'p xabar yuborildi. Iltimos biroz kuting."
+        self._notified = {}  # user_id -> time before which no new notice is sent
+        self._next_sweep = 0.0
+        self.passed = 0
+        self.dropped = 0
+        self.notices = 0
+        self.dropped_by_state = Counter()
+
+    def _sweep(self, now):
+        self.default.evict_idle(now)
+        for limit in self.by_state.values():
+            limit.evict_idle(now)
+        self._notified = {user_id: until for user_id, until in self._notified.items() if until > now}
+        self._next_sweep = now + self.SWEEP_INTERVAL
+
+    def counters(self):
+        """Totals since start, for monitoring"""
+        return {
+            'passed': self.passed,
+            'dropped': self.dropped,
+            'notices': self.notices,
+            'tracked_users': len(self.default.arrivals) + sum(
+                len(limit.arrivals) for limit in self.by_state.values()
+            ),
+            'dropped_by_state': dict(self.dropped_by_state),
+        }
+
+    async def _state(self, data):
+        """State of the update's chat, read without taking the per-user lock"""
+        if not self.by_state:
+            return None
+        context = self.fsm.resolve_event_context(data["bot"], data)
+        return await context.get_state() if context else None
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if event.message is None or user is None:
+            return await handler(event, data)
+
+        now = time.monotonic()
+        if now >= self._next_sweep:
+            self._sweep(now)
+
+        state = await self._state(data)
+        if self.by_state.get(state, self.default).allow(user.id, now):
+            self.passed += 1
+            return await handler(event, data)
+
+        self.dropped += 1
+        self.dropped_by_state[state or "none"] += 1
+        if self._notified.get(user.id, 0) <= now:
+            self._notified[user.id] = now + self.notice_window
+            self.notices += 1
+            try:
+                await event.message.answer(self.notice_text)
+            except TelegramAPIError as e:
+                logging.warning(f"Could not send flood notice to {user.id}: {e}")
+        return None
@@ -0,0 +1,30 @@
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+
+class FirstUpdateMiddleware(BaseMiddleware):
+    """Log how long after process start the first update was handled"""
+
+    def __init__(self, started_at):
+        self.started_at = started_at
+        self.seen = False
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if self.seen:
+            return await handler(event, data)
+
+        self.seen = True
+        try:
+            return await handler(event, data)
+        finally:
+            elapsed = time.perf_counter() - self.started_at
+            logging.info(f"Time to first handled update: {elapsed * 1000:.0f} ms")
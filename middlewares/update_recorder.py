@@ -0,0 +1,59 @@
+import gzip
+import json
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+
+class UpdateRecorder(BaseMiddleware):
+    """Append every incoming update to gzip-compressed JSONL files
+
+    Each line is ``{"t": <unix time of arrival>, "update": <Bot API JSON>}``.
+    A new file ``<name>-<YYYYmmdd-HHMMSS>.jsonl.gz`` is started every
+    ``rotate_seconds``, so finished files can be copied off while the bot
+    runs. Register it as the first outer update middleware so arrival times
+    don't include waiting for other middlewares; replay the files with
+    ``python -m benchmarks.replay_updates``.
+    """
+
+    def __init__(self, directory, name, rotate_seconds=3600):
+        self.directory = directory
+        self.name = name
+        self.rotate_seconds = rotate_seconds
+        self.recorded = 0
+        self._file = None
+        self._rotate_at = 0.0
+        os.makedirs(directory, exist_ok=True)
+
+    def _rotate(self, now):
+        self.close()
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(now))
+        path = os.path.join(self.directory, f"{self.name}-{stamp}.jsonl.gz")
+        self._file = gzip.open(path, "at", encoding="utf-8")
+        self._rotate_at = now + self.rotate_seconds
+        logging.info(f"Recording updates to {path}")
+
+    def close(self):
+        """Finish the current file"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        now = time.time()
+        if self._file is None or now >= self._rotate_at:
+            self._rotate(now)
+        # by_alias keeps Bot API field names ("from"), so the line parses back
+        update = event.model_dump(mode="json", by_alias=True, exclude_none=True)
+        self._file.write(json.dumps({"t": now, "update": update}, ensure_ascii=False) + "\n")
+        self.recorded += 1
+        return await handler(event, data)
@@ -0,0 +1,117 @@
+import asyncio
+import zlib
+from contextlib import asynccontextmanager
+
+import asyncpg
+from aiogram.fsm.storage.base import BaseEventIsolation, StorageKey
+
+from config import DATABASE_URL
+
+# First key of the two-int advisory lock, so user locks don't collide with
+# advisory locks taken for other purposes
+ADVISORY_LOCK_NAMESPACE = zlib.crc32(b"promocode-bot:user") & 0x7FFFFFFF
+
+
+class _UserLock:
+    __slots__ = ("lock", "holders")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.holders = 0
+
+
+class UserLocks:
+    """Per-user asyncio locks that only exist while someone holds or awaits them
+
+    Memory is bounded by the number of users with an update in flight, not by
+    the number of users ever seen.
+    """
+
+    def __init__(self):
+        self._locks = {}
+
+    def __len__(self):
+        return len(self._locks)
+
+    @asynccontextmanager
+    async def hold(self, user_id):
+        entry = self._locks.get(user_id)
+        if entry is None:
+            entry = self._locks[user_id] = _UserLock()
+        entry.holders += 1
+        try:
+            async with entry.lock:
+                yield
+        finally:
+            entry.holders -= 1
+            if entry.holders == 0:
+                del self._locks[user_id]
+
+    async def close(self):
+        pass
+
+
+class PostgresUserLocks(UserLocks):
+    """Per-user locks shared by several bot processes through advisory locks
+
+    The in-process lock is taken first so a process never holds more than one
+    lock connection per user; the session advisory lock then serializes
+    against other processes. Lock connections come from a pool of their own:
+    a handler running under the lock takes connections from the main pool,
+    and if the locks held those, ``DB_POOL_MAX_SIZE`` busy users would wait
+    forever for each other.
+    """
+
+    def __init__(self, pool_size):
+        super().__init__()
+        self.pool_size = pool_size
+        self._pool = None
+        self._pool_lock = asyncio.Lock()
+
+    async def _get_pool(self):
+        async with self._pool_lock:
+            if self._pool is None:
+                self._pool = await asyncpg.create_pool(DATABASE_URL, min_size=1, max_size=self.pool_size)
+        return self._pool
+
+    @asynccontextmanager
+    async def hold(self, user_id):
+        async with super().hold(user_id):
+            pool = await self._get_pool()
+            async with pool.acquire() as conn:
+                # Fold the 64-bit Telegram ID into the int4 second key; a
+                # collision only serializes two unrelated users
+                key = (user_id ^ (user_id >> 31)) & 0x7FFFFFFF
+                await conn.execute('SELECT pg_advisory_lock($1, $2)', ADVISORY_LOCK_NAMESPACE, key)
+                try:
+                    yield
+                finally:
+                    await conn.execute('SELECT pg_advisory_unlock($1, $2)', ADVISORY_LOCK_NAMESPACE, key)
+
+    async def close(self):
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+
+class UserEventIsolation(BaseEventIsolation):
+    """Process updates of the same user one at a time
+
+    Passed to the dispatcher as ``events_isolation``: aiogram's FSM
+    middleware takes the lock before it reads the state, so the filters and
+    handlers of an update see the state the previous update of that user
+    left, and the whole handler chain (FSM reads, DB calls, state
+    transitions) finishes before the next update of that user starts.
+    Updates of different users still run in parallel.
+    """
+
+    def __init__(self, backend="memory", pool_size=10):
+        self.locks = PostgresUserLocks(pool_size) if backend == "postgres" else UserLocks()
+
+    @asynccontextmanager
+    async def lock(self, key: StorageKey):
+        async with self.locks.hold(key.user_id):
+            yield
+
+    async def close(self) -> None:
+        await self.locks.close()
@@ -14,4 +14,9 @@ class AdminForm(StatesGroup):
     waiting_for_password = State()
     admin_menu = State()
     waiting_for_promocode_count = State()
-    waiting_for_winner_count = State()
\ No newline at end of file
+    waiting_for_winner_count = State()
+    campaign_menu = State()
+    waiting_for_campaign_name = State()
+    waiting_for_campaign_id = State()
+    waiting_for_export_format = State()
+    waiting_for_search_query = State()
\ No newline at end of file
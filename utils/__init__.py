@@ -1,3 +1,16 @@
-from .promocode_generator import generate_promocodes
-from .excel_export import export_users_to_excel, export_promocodes_to_excel
-from .channel_utils import check_subscription
\ No newline at end of file
+import importlib
+
+# Submodules are imported on first attribute access, so importing one utility
+# (e.g. utils.channel_utils in the user bot) doesn't pull in xlsxwriter and
+# the other export-only dependencies
+_EXPORTS = {
+    'generate_promocodes': '.promocode_generator',
+    'check_subscription': '.channel_utils',
+}
+
+__all__ = list(_EXPORTS)
+
+def __getattr__(name):
+    if name in _EXPORTS:
+        return getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,258 @@
+import asyncio
+import logging
+import re
+import time
+from array import array
+from collections import OrderedDict
+
+from config_user import (
+    ABUSE_WINDOW_SECONDS, ABUSE_PHONE_LIMIT, ABUSE_PREFIX_LENGTH, ABUSE_PREFIX_LIMIT,
+    ABUSE_PREFIX_SHARE, ABUSE_GLOBAL_LIMIT, ABUSE_RECENT_USERS, ABUSE_REPORT_INTERVAL
+)
+from db import save_abuse_report
+
+
+class SlidingCountMinSketch:
+    """Count-min sketch over a sliding time window
+
+    The window is split into ``buckets`` sub-windows, each with its own
+    ``depth`` x ``width`` counter table; the oldest table is zeroed when the
+    window moves on. Memory is fixed at buckets * depth * width * 4 bytes no
+    matter how many distinct keys are seen. Updates are conservative (only
+    the smallest counters of a key are raised), which keeps overestimation
+    low; estimates never undercount.
+    """
+
+    def __init__(self, window, buckets=6, width=2048, depth=4):
+        self.bucket_seconds = window / buckets
+        self.buckets = buckets
+        self.width = width
+        self.depth = depth
+        self._zero = array('I', bytes(4 * width * depth))
+        self._tables = [array('I', self._zero) for _ in range(buckets)]
+        self._epochs = [None] * buckets
+
+    def _positions(self, key):
+        return [row * self.width + hash((row, key)) % self.width for row in range(self.depth)]
+
+    def _table(self, now):
+        epoch = int(now // self.bucket_seconds)
+        index = epoch % self.buckets
+        if self._epochs[index] != epoch:
+            self._tables[index][:] = self._zero
+            self._epochs[index] = epoch
+        return self._tables[index], epoch
+
+    def add(self, key, now=None):
+        """Count one occurrence of key and return its window estimate"""
+        now = time.monotonic() if now is None else now
+        table, _ = self._table(now)
+        positions = self._positions(key)
+        smallest = min(table[position] for position in positions)
+        for position in positions:
+            if table[position] == smallest:
+                table[position] += 1
+        return self._estimate(positions, now)
+
+    def estimate(self, key, now=None):
+        """Estimate occurrences of key within the window"""
+        now = time.monotonic() if now is None else now
+        return self._estimate(self._positions(key), now)
+
+    def _estimate(self, positions, now):
+        _, current = self._table(now)
+        live = [
+            table for table, epoch in zip(self._tables, self._epochs)
+            if epoch is not None and current - epoch < self.buckets
+        ]
+        return min(sum(table[position] for table in live) for position in positions)
+
+
+class SlidingCounter:
+    """Plain event counter over the same kind of sliding window"""
+
+    def __init__(self, window, buckets=6):
+        self.bucket_seconds = window / buckets
+        self.buckets = buckets
+        self._counts = [0] * buckets
+        self._epochs = [None] * buckets
+
+    def add(self, now=None):
+        now = time.monotonic() if now is None else now
+        epoch = int(now // self.bucket_seconds)
+        index = epoch % self.buckets
+        if self._epochs[index] != epoch:
+            self._counts[index] = 0
+            self._epochs[index] = epoch
+        self._counts[index] += 1
+        return self.total(now)
+
+    def total(self, now=None):
+        now = time.monotonic() if now is None else now
+        current = int(now // self.bucket_seconds)
+        return sum(
+            count for count, epoch in zip(self._counts, self._epochs)
+            if epoch is not None and current - epoch < self.buckets
+        )
+
+
+class RecentUsers:
+    """Users seen within the window, tracked exactly
+
+    Keeps the time each user was last seen, oldest first. Beyond
+    ``capacity`` users the oldest are forgotten early, which can only make a
+    user look like they weren't seen, never the other way round.
+    """
+
+    def __init__(self, window, capacity):
+        self.window = window
+        self.capacity = capacity
+        self._seen = OrderedDict()
+
+    def add(self, user_id, now=None):
+        now = time.monotonic() if now is None else now
+        self._seen[user_id] = now
+        self._seen.move_to_end(user_id)
+        while self._seen and (
+            len(self._seen) > self.capacity or now - next(iter(self._seen.values())) >= self.window
+        ):
+            self._seen.popitem(last=False)
+
+    def seen(self, user_id, now=None):
+        now = time.monotonic() if now is None else now
+        seen_at = self._seen.get(user_id)
+        return seen_at is not None and now - seen_at < self.window
+
+    def __len__(self):
+        return len(self._seen)
+
+
+class HeavyHitters:
+    """The ``capacity`` keys with the highest sketch estimates seen recently"""
+
+    def __init__(self, sketch, capacity=10):
+        self.sketch = sketch
+        self.capacity = capacity
+        self._keys = {}
+
+    def offer(self, key, estimate):
+        if key in self._keys or len(self._keys) < self.capacity:
+            self._keys[key] = estimate
+            return
+        smallest = min(self._keys, key=self._keys.get)
+        if estimate > self._keys[smallest]:
+            del self._keys[smallest]
+            self._keys[key] = estimate
+
+    def top(self, now=None):
+        """Current (key, estimate) pairs, refreshed against the sliding window"""
+        for key in list(self._keys):
+            estimate = self.sketch.estimate(key, now)
+            if estimate:
+                self._keys[key] = estimate
+            else:
+                del self._keys[key]
+        return sorted(self._keys.items(), key=lambda item: item[1], reverse=True)
+
+
+class AbuseDetector:
+    """Flags bursts per phone number, per code prefix and globally
+
+    Fed from registration and promocode submission. A flagged registration is
+    refused; a submission is throttled (answered without a DB lookup) when
+    the user had a wrong attempt in the window and the code's prefix is hot:
+    at least ABUSE_PREFIX_LIMIT wrong attempts and ABUSE_PREFIX_SHARE of all
+    of them. Users with wrong attempts are tracked exactly, so a user who
+    never failed is never throttled, and the share keeps a busy launch, whose
+    typos spread over all prefixes, from making any prefix hot. A global
+    burst of wrong attempts is only reported. Flagged activity is
+    periodically saved as a report for the admin panel.
+    """
+
+    def __init__(self, window=ABUSE_WINDOW_SECONDS):
+        self.window = window
+        # Phones and users have many distinct keys per window, prefixes few.
+        # Phone flags refuse registrations, so that sketch gets the widest
+        # table (~6 MB) to keep false positives negligible at launch-day rates
+        self.phones = SlidingCountMinSketch(window, width=65536)
+        self.prefixes = SlidingCountMinSketch(window)
+        self.failed_users = RecentUsers(window, ABUSE_RECENT_USERS)
+        self.wrong = SlidingCounter(window)
+        self.top_phones = HeavyHitters(self.phones)
+        self.top_prefixes = HeavyHitters(self.prefixes)
+        self.throttled = 0
+        self._flagged = False
+        self._task = None
+
+    @staticmethod
+    def _prefix(code):
+        return code[:ABUSE_PREFIX_LENGTH]
+
+    def _prefix_hot(self, estimate):
+        return estimate >= ABUSE_PREFIX_LIMIT and estimate >= ABUSE_PREFIX_SHARE * self.wrong.total()
+
+    def observe_phone(self, phone_number):
+        """Count a registration; returns True if the phone is registering too often"""
+        phone = re.sub(r"\D", "", phone_number or "")
+        estimate = self.phones.add(phone)
+        self.top_phones.offer(phone, estimate)
+        if estimate > ABUSE_PHONE_LIMIT:
+            self._flagged = True
+            self.throttled += 1
+            return True
+        return False
+
+    def should_throttle(self, user_id, code):
+        """Decide before any DB work whether a submission goes to the throttle path"""
+        if not self.failed_users.seen(user_id):
+            return False
+        if self._prefix_hot(self.prefixes.estimate(self._prefix(code))):
+            self._flagged = True
+            self.throttled += 1
+            return True
+        return False
+
+    def observe_wrong_code(self, user_id, code):
+        """Count a wrong or already used code"""
+        self.failed_users.add(user_id)
+        wrong_total = self.wrong.add()
+        estimate = self.prefixes.add(self._prefix(code))
+        self.top_prefixes.offer(self._prefix(code), estimate)
+        if self._prefix_hot(estimate) or wrong_total >= ABUSE_GLOBAL_LIMIT:
+            self._flagged = True
+
+    def summary(self):
+        """Snapshot of the current window for the admin report"""
+        return {
+            'window_seconds': self.window,
+            'wrong_attempts': self.wrong.total(),
+            'global_burst': self.wrong.total() >= ABUSE_GLOBAL_LIMIT,
+            'throttled': self.throttled,
+            'phones': [[key, count] for key, count in self.top_phones.top() if count > ABUSE_PHONE_LIMIT],
+            'prefixes': [[key, count] for key, count in self.top_prefixes.top() if self._prefix_hot(count)],
+        }
+
+    async def start(self):
+        """Start saving reports while something is flagged"""
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(ABUSE_REPORT_INTERVAL)
+            if not self._flagged:
+                continue
+            self._flagged = False
+            try:
+                await save_abuse_report(self.summary())
+            except Exception as e:
+                logging.error(f"Error saving abuse report: {e}")
+            self.throttled = 0
+
+
+abuse_detector = AbuseDetector()
@@ -0,0 +1,116 @@
+import asyncio
+import hashlib
+import logging
+from datetime import datetime
+
+from config_user import ATTEMPT_LOG_FLUSH_SIZE, ATTEMPT_LOG_FLUSH_INTERVAL, ATTEMPT_LOG_MAX_BUFFER
+from db import create_attempts_partition, copy_submission_attempts
+
+
+def hash_code(code):
+    """Hash a submitted code so the log never stores valid codes in clear text"""
+    return hashlib.blake2b(code.encode("utf-8"), digest_size=16).digest()
+
+
+def _month_bounds(moment):
+    start = moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    if start.month == 12:
+        end = start.replace(year=start.year + 1, month=1)
+    else:
+        end = start.replace(month=start.month + 1)
+    return start, end
+
+
+class AttemptLog:
+    """Write-behind buffer for the submission_attempts table
+
+    ``log`` only appends to an in-memory list; a background task flushes the
+    buffer with COPY once ``flush_size`` events are waiting or every
+    ``flush_interval`` seconds. When the database falls behind and
+    ``max_buffer`` events are pending, ``log`` waits for the next flush
+    instead of growing without bound. ``close`` flushes whatever is left.
+    """
+
+    def __init__(self, flush_size=ATTEMPT_LOG_FLUSH_SIZE, flush_interval=ATTEMPT_LOG_FLUSH_INTERVAL,
+                 max_buffer=ATTEMPT_LOG_MAX_BUFFER):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self._buffer = []
+        self._flush_requested = asyncio.Event()
+        self._not_full = asyncio.Event()
+        self._not_full.set()
+        self._partitions = set()
+        self._task = None
+        self._closing = False
+        self.written = 0
+        self.failed_flushes = 0
+
+    async def start(self):
+        """Start the background flusher"""
+        await self._ensure_partition(datetime.now())
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Stop the flusher and write out the remaining events"""
+        if self._task is None:
+            return
+        # Let a flush in progress finish rather than cancelling it mid-COPY
+        self._closing = True
+        self._flush_requested.set()
+        await self._task
+        self._task = None
+        while self._buffer:
+            if not await self._flush():
+                logging.error(f"Dropping {len(self._buffer)} unwritten submission attempts")
+                break
+
+    async def log(self, user_id, code, outcome):
+        """Record a submission attempt; a no-op while the log isn't started"""
+        if self._task is None:
+            return
+        while len(self._buffer) >= self.max_buffer:
+            self._not_full.clear()
+            await self._not_full.wait()
+        self._buffer.append((user_id, hash_code(code), outcome, datetime.now()))
+        if len(self._buffer) >= self.flush_size:
+            self._flush_requested.set()
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+            if self._buffer and not self._closing:
+                if not await self._flush():
+                    # Back off before retrying the same batch
+                    await asyncio.sleep(self.flush_interval)
+
+    async def _ensure_partition(self, moment):
+        start, end = _month_bounds(moment)
+        if start not in self._partitions:
+            await create_attempts_partition(start, end)
+            self._partitions.add(start)
+
+    async def _flush(self):
+        batch, self._buffer = self._buffer, []
+        try:
+            for moment in {record[3] for record in (batch[0], batch[-1])}:
+                await self._ensure_partition(moment)
+            await copy_submission_attempts(batch)
+        except Exception as e:
+            logging.error(f"Error writing submission attempts: {e}")
+            self.failed_flushes += 1
+            # Keep the batch for the next try; new events queue up behind it
+            self._buffer = batch + self._buffer
+            return False
+        finally:
+            if len(self._buffer) < self.max_buffer:
+                self._not_full.set()
+        self.written += len(batch)
+        return True
+
+
+attempt_log = AttemptLog()
@@ -0,0 +1,101 @@
+import time
+from collections import OrderedDict
+
+from config_user import USER_STATUS_CACHE_SIZE, WRONG_CODE_CACHE_SIZE
+from db import get_user_status
+from utils.event_bus import event_bus
+
+
+class UserStatusCache:
+    """Registration and block state of users, kept in sync across processes
+
+    Only registered users are cached, as the monotonic time their block ends
+    (0 when not blocked). Entries are dropped on ``user_updated`` events and
+    the whole cache on a resync; while the event bus is down every lookup
+    goes to the database.
+    """
+
+    def __init__(self, bus=event_bus, max_size=USER_STATUS_CACHE_SIZE):
+        self.bus = bus
+        self.max_size = max_size
+        self._users = OrderedDict()
+        # Bumped on every invalidation so a lookup racing an event isn't cached
+        self._generation = 0
+        bus.subscribe('user_updated', lambda event: self.forget(event['telegram_id']))
+        bus.on_resync(self.clear)
+
+    def forget(self, telegram_id):
+        self._generation += 1
+        self._users.pop(telegram_id, None)
+
+    def clear(self):
+        self._generation += 1
+        self._users.clear()
+
+    async def _blocked_until(self, telegram_id):
+        """Monotonic end of the user's block, 0 if not blocked, None if unknown user"""
+        if self.bus.live and telegram_id in self._users:
+            self._users.move_to_end(telegram_id)
+            return self._users[telegram_id]
+
+        generation = self._generation
+        blocked_seconds = await get_user_status(telegram_id)
+        if blocked_seconds is None:
+            return None
+        blocked_until = time.monotonic() + float(blocked_seconds) if blocked_seconds else 0
+        if self.bus.live and generation == self._generation:
+            self._users[telegram_id] = blocked_until
+            if len(self._users) > self.max_size:
+                self._users.popitem(last=False)
+        return blocked_until
+
+    async def is_registered(self, telegram_id):
+        return await self._blocked_until(telegram_id) is not None
+
+    async def is_blocked(self, telegram_id):
+        blocked_until = await self._blocked_until(telegram_id)
+        return bool(blocked_until) and blocked_until > time.monotonic()
+
+
+class WrongCodeCache:
+    """Recently submitted codes that exist in no live campaign
+
+    Lets repeated wrong guesses skip the redemption query. Any new codes or
+    campaign change can make a wrong code valid, so ``codes_added`` and
+    ``campaign_changed`` events (and resyncs) empty the cache.
+    """
+
+    def __init__(self, bus=event_bus, max_size=WRONG_CODE_CACHE_SIZE):
+        self.bus = bus
+        self.max_size = max_size
+        self._codes = OrderedDict()
+        self.generation = 0
+        self.hits = 0
+        bus.subscribe('codes_added', lambda event: self.clear())
+        bus.subscribe('campaign_changed', lambda event: self.clear())
+        bus.on_resync(self.clear)
+
+    def clear(self):
+        self.generation += 1
+        self._codes.clear()
+
+    def is_wrong(self, code):
+        if self.bus.live and code in self._codes:
+            self._codes.move_to_end(code)
+            self.hits += 1
+            return True
+        return False
+
+    def add(self, codes, generation):
+        """Remember codes found wrong by a lookup that started at ``generation``"""
+        if not self.bus.live or generation != self.generation:
+            return
+        for code in codes:
+            self._codes[code] = None
+            self._codes.move_to_end(code)
+        while len(self._codes) > self.max_size:
+            self._codes.popitem(last=False)
+
+
+user_status = UserStatusCache()
+wrong_codes = WrongCodeCache()
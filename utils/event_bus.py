@@ -0,0 +1,112 @@
+import asyncio
+import json
+import logging
+
+import asyncpg
+
+from config import DATABASE_URL, EVENTS_CHANNEL, EVENT_BUS_PING_INTERVAL, EVENT_BUS_RECONNECT_DELAY
+
+# Events published by db.py write paths; each payload carries 'event' plus:
+#   codes_added      campaign_id, count
+#   user_updated     telegram_id
+#   campaign_changed campaign_id
+EVENTS = ('codes_added', 'user_updated', 'campaign_changed')
+
+
+class EventBus:
+    """Receives cache invalidation events from every bot process
+
+    Listens on a dedicated connection outside the pool. Postgres delivers
+    every committed notification to a connected listener, so events can only
+    be missed while that connection is down; ``live`` is False then, and
+    resync callbacks run each time listening (re)starts, before ``live`` is
+    set again. Caches should only serve entries while the bus is live.
+    """
+
+    def __init__(self, dsn=DATABASE_URL, channel=EVENTS_CHANNEL,
+                 ping_interval=EVENT_BUS_PING_INTERVAL, reconnect_delay=EVENT_BUS_RECONNECT_DELAY):
+        self.dsn = dsn
+        self.channel = channel
+        self.ping_interval = ping_interval
+        self.reconnect_delay = reconnect_delay
+        self.live = False
+        self._handlers = {event: [] for event in EVENTS}
+        self._resync_handlers = []
+        self._task = None
+        self.received = 0
+        self.reconnects = 0
+
+    def subscribe(self, event, callback):
+        """Call ``callback(payload)`` for every event of this type"""
+        self._handlers[event].append(callback)
+
+    def on_resync(self, callback):
+        """Call ``callback()`` whenever events may have been missed"""
+        self._resync_handlers.append(callback)
+
+    async def start(self):
+        """Start listening in the background"""
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def _dispatch(self, connection, pid, channel, payload):
+        try:
+            message = json.loads(payload)
+        except ValueError:
+            logging.error(f"Ignoring malformed event: {payload!r}")
+            return
+        self.received += 1
+        for callback in self._handlers.get(message.get('event'), ()):
+            try:
+                callback(message)
+            except Exception:
+                logging.exception(f"Error handling {message.get('event')} event")
+
+    def _resync(self):
+        for callback in self._resync_handlers:
+            try:
+                callback()
+            except Exception:
+                logging.exception("Error resyncing cache")
+
+    async def _listen(self):
+        conn = await asyncpg.connect(self.dsn)
+        try:
+            lost = asyncio.Event()
+            conn.add_termination_listener(lambda connection: lost.set())
+            await conn.add_listener(self.channel, self._dispatch)
+            # Whatever changed before LISTEN took effect is unknown
+            self._resync()
+            self.live = True
+            while not lost.is_set():
+                try:
+                    await asyncio.wait_for(lost.wait(), self.ping_interval)
+                except asyncio.TimeoutError:
+                    # A silently dropped connection never reports termination
+                    await asyncio.wait_for(conn.fetchval("SELECT 1"), self.ping_interval)
+        finally:
+            self.live = False
+            conn.terminate()
+
+    async def _run(self):
+        delay = self.reconnect_delay
+        while True:
+            try:
+                await self._listen()
+                delay = self.reconnect_delay
+                logging.warning("Event listener connection lost, reconnecting")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Event listener failed, retrying in {delay}s: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
+            self.reconnects += 1
+
+
+event_bus = EventBus()
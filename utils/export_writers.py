@@ -0,0 +1,230 @@
+import asyncio
+import csv
+import gzip
+import io
+import json
+from io import BytesIO
+
+import xlsxwriter
+
+# Telegram bots may upload documents up to 50 MB; keep a safety margin
+MAX_PART_BYTES = 45 * 1024 * 1024
+
+
+class ExportTable:
+    """Describes one exported table: file name, sheet, columns and row mapping
+
+    ``row`` receives the 1-based row number and a source record and returns
+    the row values in ``headers`` order. ``fields`` are the keys used by
+    formats that need machine-friendly column names (JSONL).
+    """
+
+    __slots__ = ("name", "sheet", "headers", "fields", "row")
+
+    def __init__(self, name, sheet, headers, fields, row):
+        self.name = name
+        self.sheet = sheet
+        self.headers = headers
+        self.fields = fields
+        self.row = row
+
+
+USERS_TABLE = ExportTable(
+    "users", "Foydalanuvchilar",
+    ["№", "Telegram ID", "Ism", "Telefon raqami", "Ro'yxatdan o'tgan vaqt", "Promokodlar soni"],
+    ["n", "telegram_id", "full_name", "phone_number", "registered_at", "promocode_count"],
+    lambda n, user: (
+        n, str(user['telegram_id']), user['full_name'], user['phone_number'],
+        user['registered_at'].strftime('%Y-%m-%d %H:%M:%S'), user['promocode_count']
+    ),
+)
+
+PROMOCODES_TABLE = ExportTable(
+    "promocodes", "Promokodlar",
+    ["№", "Promokod"],
+    ["n", "code"],
+    lambda n, code: (n, code),
+)
+
+WINNERS_TABLE = ExportTable(
+    "winners", "G'oliblar",
+    ["№", "Telegram ID", "Ism", "Telefon raqami", "Promokodlar soni"],
+    ["n", "telegram_id", "full_name", "phone_number", "promocode_count"],
+    lambda n, winner: (
+        n, str(winner['telegram_id']), winner['full_name'], winner['phone_number'],
+        winner['promocode_count']
+    ),
+)
+
+
+class XlsxPartWriter:
+    """Streams rows into a single-sheet workbook in constant memory mode
+
+    The zipped size is only known after closing, so the part size is
+    estimated from the uncompressed cell text, which the compressed
+    workbook stays below.
+    """
+
+    extension = "xlsx"
+    max_rows = 1_048_575  # Sheet row limit minus the header row
+
+    def __init__(self, table):
+        self.output = BytesIO()
+        self.workbook = xlsxwriter.Workbook(self.output, {'constant_memory': True})
+        self.worksheet = self.workbook.add_worksheet(table.sheet)
+        self.worksheet.write_row(0, 0, table.headers)
+        self.rows = 0
+        self.size = 0
+
+    def write_row(self, row):
+        self.rows += 1
+        self.worksheet.write_row(self.rows, 0, row)
+        self.size += sum(len(str(value)) + 8 for value in row)
+
+    def close(self):
+        self.workbook.close()
+        return self.output.getvalue()
+
+
+class CsvPartWriter:
+    """Writes UTF-8 CSV with a BOM so Excel detects the encoding"""
+
+    extension = "csv"
+    max_rows = None
+
+    def __init__(self, table):
+        self.output = BytesIO()
+        self.output.write(b"\xef\xbb\xbf")
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer)
+        self.rows = 0
+        self._write(table.headers)
+
+    def _write(self, row):
+        self.writer.writerow(row)
+        self.output.write(self.buffer.getvalue().encode("utf-8"))
+        self.buffer.seek(0)
+        self.buffer.truncate()
+
+    def write_row(self, row):
+        self.rows += 1
+        self._write(row)
+
+    @property
+    def size(self):
+        return self.output.tell()
+
+    def close(self):
+        return self.output.getvalue()
+
+
+class JsonlGzPartWriter:
+    """Writes one JSON object per line through gzip compression"""
+
+    extension = "jsonl.gz"
+    max_rows = None
+
+    def __init__(self, table):
+        self.fields = table.fields
+        self.output = BytesIO()
+        self.gzip = gzip.GzipFile(fileobj=self.output, mode="wb", compresslevel=6)
+        self.rows = 0
+
+    def write_row(self, row):
+        self.rows += 1
+        line = json.dumps(dict(zip(self.fields, row)), ensure_ascii=False, default=str)
+        self.gzip.write(line.encode("utf-8") + b"\n")
+
+    @property
+    def size(self):
+        # Bytes still buffered by the compressor are not counted; the part
+        # limit leaves enough margin for them
+        return self.output.tell()
+
+    def close(self):
+        self.gzip.close()
+        return self.output.getvalue()
+
+
+EXPORT_FORMATS = {
+    "xlsx": XlsxPartWriter,
+    "csv": CsvPartWriter,
+    "jsonl.gz": JsonlGzPartWriter,
+}
+
+
+class ExportPart:
+    """One finished file of an export"""
+
+    __slots__ = ("filename", "data", "rows")
+
+    def __init__(self, filename, data, rows):
+        self.filename = filename
+        self.data = data
+        self.rows = rows
+
+
+async def _batches(records, batch_size):
+    """Group a sync or async iterable of records into lists"""
+    batch = []
+    if hasattr(records, "__aiter__"):
+        async for record in records:
+            batch.append(record)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    else:
+        for record in records:
+            batch.append(record)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+async def export_parts(table, records, fmt="xlsx", max_part_bytes=MAX_PART_BYTES, batch_size=5000):
+    """Write records in the given format, yielding size-bounded ExportParts
+
+    ``records`` may be a list or an async iterator (e.g. a database cursor),
+    so exports stream without holding every row in memory. Rows are written
+    in a worker thread batch by batch. A single-part export is named
+    ``<table>.<ext>``; multi-part exports are numbered ``<table>_1.<ext>``...
+    """
+    writer_cls = EXPORT_FORMATS[fmt]
+    writer = None
+    n = 0
+
+    def write_batch(batch):
+        nonlocal writer, n
+        finished = []
+        for record in batch:
+            if writer is None:
+                writer = writer_cls(table)
+            n += 1
+            writer.write_row(table.row(n, record))
+            if writer.size >= max_part_bytes or writer.rows == writer_cls.max_rows:
+                finished.append((writer.close(), writer.rows))
+                writer = None
+        return finished
+
+    # Hold one finished part back so the last one knows whether to be numbered
+    pending = None
+    part = 0
+    async for batch in _batches(records, batch_size):
+        for data, rows in await asyncio.to_thread(write_batch, batch):
+            if pending:
+                part += 1
+                yield ExportPart(f"{table.name}_{part}.{writer_cls.extension}", *pending)
+            pending = (data, rows)
+
+    if writer is not None:
+        last = await asyncio.to_thread(lambda: (writer.close(), writer.rows))
+        if pending:
+            part += 1
+            yield ExportPart(f"{table.name}_{part}.{writer_cls.extension}", *pending)
+        pending = last
+
+    if pending:
+        name = f"{table.name}_{part + 1}" if part else table.name
+        yield ExportPart(f"{name}.{writer_cls.extension}", *pending)
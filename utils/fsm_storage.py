@@ -0,0 +1,175 @@
+import sys
+import time
+from collections import deque
+from itertools import islice
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey, StateType
+
+
+class _Entry:
+    """State and data of a chat that has data; chats with only a state are
+    stored as the bare (interned) state name"""
+
+    __slots__ = ("state", "data")
+
+    def __init__(self, state, data):
+        self.state = state
+        self.data = data
+
+
+def _deep_size(value):
+    """Approximate bytes held by a value and the containers inside it"""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(_deep_size(k) + _deep_size(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set)):
+        size += sum(_deep_size(item) for item in value)
+    return size
+
+
+class BoundedMemoryStorage(BaseStorage):
+    """In-memory FSM storage with idle expiry and an entry cap
+
+    Entries live in generations of ``ttl / GENERATIONS`` seconds: a chat that
+    is read or written moves into the current generation, and a generation
+    is dropped whole once it is ``ttl`` old, so idle chats expire after
+    between ``ttl`` minus one generation and ``ttl`` seconds without keeping a
+    timestamp per chat. A generation also ends once it holds
+    ``max_entries / GENERATIONS`` chats, and beyond ``max_entries`` chats
+    entries of the oldest generation go first. Private chat keys of the first bot seen are stored
+    as the bare user id. A dropped entry reads as no state and no data, like
+    after a restart with ``MemoryStorage``.
+    """
+
+    GENERATIONS = 24
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.generation_seconds = ttl / self.GENERATIONS
+        self.generation_size = max(1, max_entries // self.GENERATIONS)
+        self._generations = deque()  # (slot, {key: state or _Entry}), oldest first
+        self._size = 0
+        self._bot_id = None
+        self.expired = 0
+        self.evicted = 0
+
+    def _key(self, key: StorageKey):
+        if self._bot_id is None:
+            self._bot_id = key.bot_id
+        if (key.bot_id == self._bot_id and key.chat_id == key.user_id and key.thread_id is None
+                and getattr(key, "business_connection_id", None) is None
+                and key.destiny == "default"):
+            return key.user_id
+        return key
+
+    def _current(self):
+        """The current generation, dropping the ones that have expired"""
+        slot = int(time.monotonic() // self.generation_seconds)
+        if not self._generations or self._generations[-1][0] != slot:
+            self._generations.append((slot, {}))
+            while self._generations[0][0] <= slot - self.GENERATIONS:
+                _, expired = self._generations.popleft()
+                self._size -= len(expired)
+                self.expired += len(expired)
+        return self._generations[-1][1]
+
+    def _find(self, compact):
+        """Stored value of a key, moved into the current generation"""
+        current = self._current()
+        value = current.get(compact)
+        if value is None:
+            for _, generation in islice(reversed(self._generations), 1, None):
+                value = generation.pop(compact, None)
+                if value is not None:
+                    current[compact] = value
+                    break
+        return value, current
+
+    def _add(self, current, compact, value):
+        if len(current) >= self.generation_size:
+            slot = self._generations[-1][0]
+            current = {}
+            self._generations.append((slot, current))
+        current[compact] = value
+        self._size += 1
+        while self._size > self.max_entries:
+            oldest = self._generations[0][1]
+            if not oldest:
+                self._generations.popleft()
+                continue
+            oldest.popitem()
+            self._size -= 1
+            self.evicted += 1
+
+    def _set(self, current, compact, value, state, data):
+        """Store a state and data for a key whose current value is ``value``"""
+        if state is None and not data:
+            if value is not None:
+                del current[compact]
+                self._size -= 1
+            return
+        new = _Entry(state, data.copy()) if data else state
+        if value is None:
+            self._add(current, compact, new)
+        else:
+            current[compact] = new
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        if isinstance(state, State):
+            state = state.state
+        if state is not None:
+            state = sys.intern(state)
+        compact = self._key(key)
+        value, current = self._find(compact)
+        if isinstance(value, _Entry):
+            value.state = state
+        else:
+            self._set(current, compact, value, state, None)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        value, _ = self._find(self._key(key))
+        return value.state if isinstance(value, _Entry) else value
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        compact = self._key(key)
+        value, current = self._find(compact)
+        state = value.state if isinstance(value, _Entry) else value
+        self._set(current, compact, value, state, data)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        value, _ = self._find(self._key(key))
+        return value.data.copy() if isinstance(value, _Entry) else {}
+
+    async def close(self) -> None:
+        pass
+
+    def __len__(self):
+        return self._size
+
+    def memory_usage(self, sample=1000):
+        """Estimate bytes per entry and in total from recently used entries
+
+        Counts the stored key, the entry record and its data, and the hash
+        tables shared out over the entries; state names are interned and
+        shared by all entries, so they are left out.
+        """
+        per_entry = 0
+        if self._size:
+            recent = list(islice(self._generations[-1][1].items(), sample))
+            if recent:
+                per_entry = sum(
+                    _deep_size(compact)
+                    + (sys.getsizeof(value) + _deep_size(value.data) if isinstance(value, _Entry) else 0)
+                    for compact, value in recent
+                ) / len(recent)
+            per_entry += sum(sys.getsizeof(generation) for _, generation in self._generations) / self._size
+        return {
+            'entries': self._size,
+            'bytes_per_entry': round(per_entry),
+            'total_bytes': round(per_entry * self._size),
+            'expired': self.expired,
+            'evicted': self.evicted,
+        }
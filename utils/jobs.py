@@ -0,0 +1,168 @@
+import asyncio
+import logging
+import time
+
+from aiogram import Bot
+
+from db import create_job, get_job, claim_job, update_job, fail_interrupted_jobs, get_queued_job_ids
+
+# Minimum seconds between two edits of the same status message
+PROGRESS_EDIT_INTERVAL = 2.0
+
+
+class JobFailed(Exception):
+    """Raised by a job handler to fail the job with a message for the admin"""
+
+
+class JobContext:
+    """Handle passed to a job handler for reading params and reporting progress"""
+
+    def __init__(self, runner, job):
+        self.runner = runner
+        self.job_id = job['id']
+        self.chat_id = job['chat_id']
+        self.message_id = job['message_id']
+        self.params = job['params']
+        self.sent_documents = []
+        self._last_edit = 0.0
+        self._last_text = None
+
+    async def progress(self, text, percent=None, force=False):
+        """Show progress in the job's status message, throttled to avoid flood limits"""
+        now = time.monotonic()
+        if not force and now - self._last_edit < PROGRESS_EDIT_INTERVAL:
+            return
+        if percent is not None:
+            text = f"{text} ({percent}%)"
+            await update_job(self.job_id, progress=percent)
+        await self.runner.set_status(self, f"⏳ {text}")
+        self._last_edit = now
+
+
+class JobRunner:
+    """Bounded pool of asyncio workers executing persisted admin jobs
+
+    Job handlers are registered per kind and receive a JobContext. A handler
+    returns ``(document, caption)`` to deliver a file, an async iterator of
+    such pairs to deliver files one by one as they are produced, or a text
+    message. Documents are passed to ``send_document`` as-is, so a Telegram
+    ``file_id`` string re-sends an earlier upload; the file_id and caption of
+    every sent document are collected in ``JobContext.sent_documents``.
+    Heavy kinds share a separate semaphore so that concurrent exports cannot
+    take every database connection away from user traffic.
+    """
+
+    def __init__(self, bot: Bot, workers=2, heavy_concurrency=1):
+        self.bot = bot
+        self.workers = workers
+        self.queue = asyncio.Queue()
+        self.handlers = {}
+        self.heavy_kinds = set()
+        self.heavy_semaphore = asyncio.Semaphore(heavy_concurrency)
+        self._tasks = []
+
+    def register(self, kind, handler, heavy=False):
+        """Register the handler coroutine for a job kind"""
+        self.handlers[kind] = handler
+        if heavy:
+            self.heavy_kinds.add(kind)
+
+    async def start(self):
+        """Recover persisted jobs and start the workers"""
+        for job in await fail_interrupted_jobs():
+            if job['message_id']:
+                await self._edit(job['chat_id'], job['message_id'],
+                                 "❌ Vazifa bot qayta ishga tushgani sababli to'xtatildi.")
+        for job_id in await get_queued_job_ids():
+            self.queue.put_nowait(job_id)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """Stop the workers; unfinished jobs are failed on the next start"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def enqueue(self, kind, chat_id, **params):
+        """Persist a job, post its status message and queue it"""
+        job_id = await create_job(kind, chat_id, params)
+        status = await self.bot.send_message(chat_id, f"🕓 Vazifa #{job_id} navbatga qo'yildi.")
+        await update_job(job_id, message_id=status.message_id)
+        self.queue.put_nowait(job_id)
+        return job_id
+
+    async def set_status(self, ctx, text):
+        """Replace the text of the job's status message"""
+        if text == ctx._last_text:
+            return
+        ctx._last_text = text
+        await self._edit(ctx.chat_id, ctx.message_id, f"Vazifa #{ctx.job_id}: {text}")
+
+    async def _edit(self, chat_id, message_id, text):
+        try:
+            await self.bot.edit_message_text(text, chat_id=chat_id, message_id=message_id)
+        except Exception as e:
+            logging.warning(f"Could not edit job status message: {e}")
+
+    async def _send_document(self, ctx, document, caption):
+        sent = await self.bot.send_document(ctx.chat_id, document=document, caption=caption)
+        ctx.sent_documents.append((sent.document.file_id, caption))
+
+    async def _worker(self):
+        while True:
+            job_id = await self.queue.get()
+            try:
+                await self._run(job_id)
+            except Exception:
+                logging.exception(f"Job #{job_id} crashed")
+            finally:
+                self.queue.task_done()
+
+    async def _execute(self, handler, ctx):
+        """Run the handler and deliver what it returned"""
+        result = await handler(ctx)
+        if isinstance(result, tuple):
+            document, caption = result
+            await ctx.progress("Fayl yuborilmoqda", force=True)
+            await self._send_document(ctx, document, caption)
+        elif hasattr(result, "__aiter__"):
+            sent = 0
+            async for document, caption in result:
+                sent += 1
+                await ctx.progress(f"{sent}-fayl yuborilmoqda", force=True)
+                await self._send_document(ctx, document, caption)
+        elif result:
+            await self.bot.send_message(ctx.chat_id, result)
+
+    async def _run(self, job_id):
+        if not await claim_job(job_id):
+            return
+        job = await get_job(job_id)
+
+        ctx = JobContext(self, job)
+        handler = self.handlers.get(job['kind'])
+        if handler is None:
+            await update_job(job_id, status='failed', error=f"unknown job kind {job['kind']}")
+            return
+
+        try:
+            if job['kind'] in self.heavy_kinds:
+                # Streamed exports query and build files while being sent,
+                # so delivery counts as part of the heavy work
+                async with self.heavy_semaphore:
+                    await self._execute(handler, ctx)
+            else:
+                await self._execute(handler, ctx)
+        except JobFailed as e:
+            await update_job(job_id, status='failed', error=str(e))
+            await self.set_status(ctx, f"❌ {e}")
+            return
+        except Exception as e:
+            logging.exception(f"Job #{job_id} failed")
+            await update_job(job_id, status='failed', error=str(e))
+            await self.set_status(ctx, "❌ Xatolik yuz berdi. Iltimos qayta urinib ko'ring.")
+            return
+
+        await update_job(job_id, status='done', progress=100)
+        await self.set_status(ctx, "✅ Tayyor.")
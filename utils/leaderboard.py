@@ -0,0 +1,169 @@
+import asyncio
+import logging
+from datetime import timedelta
+
+from config import LEADERBOARD_RECONCILE_INTERVAL
+from db import get_redeemed_counts
+
+
+class Leaderboard:
+    """Users ranked by redeemed codes, kept in memory
+
+    Users are grouped by count, each group in the order its users reached
+    the count, and a Fenwick tree over counts holds how many users have each
+    count. A user's rank and the next lower count anybody has are
+    O(log max_count) lookups, so ``rank`` is O(log max_count), ``top(k)``
+    O(k log max_count) and ``update`` O(log max_count); nothing scans all
+    users. Loaded from ``users.redeemed_count`` in the background after
+    ``start``, updated by this process's redemptions and reconciled with the
+    database every ``reconcile_interval`` seconds, which brings in
+    redemptions of other processes. Counts only grow, so an update never
+    lowers a count: a reconcile that read before a redemption can't undo it.
+    """
+
+    # Seconds each reconcile also re-reads before the previous one, for
+    # redemptions that were in flight while it read
+    RECONCILE_OVERLAP = 60
+
+    def __init__(self, reconcile_interval=LEADERBOARD_RECONCILE_INTERVAL):
+        self.reconcile_interval = reconcile_interval
+        self.loaded = False
+        self._counts = {}  # telegram_id -> count, users with a count only
+        self._groups = {}  # count -> {telegram_id: None}, in order of reaching it
+        self._size = 64  # Largest count the tree covers, a power of two
+        self._tree = [0] * (self._size + 1)
+        self._synced_at = None
+        self._task = None
+
+    def _add(self, count, delta):
+        while count <= self._size:
+            self._tree[count] += delta
+            count += count & -count
+
+    def _at_most(self, count):
+        """Number of users with at most ``count`` codes"""
+        total = 0
+        count = min(count, self._size)
+        while count > 0:
+            total += self._tree[count]
+            count -= count & -count
+        return total
+
+    def _count_at(self, position):
+        """Count of the user at ``position`` (from 1) in ascending order"""
+        index = 0
+        step = self._size
+        while step:
+            if index + step <= self._size and self._tree[index + step] < position:
+                index += step
+                position -= self._tree[index]
+            step >>= 1
+        return index + 1
+
+    def _build_tree(self):
+        """Rebuild the tree from the groups, growing it to the largest count"""
+        largest = max(self._groups, default=0)
+        while self._size < largest:
+            self._size *= 2
+        self._tree = [0] * (self._size + 1)
+        for count, group in self._groups.items():
+            self._tree[count] = len(group)
+        for index in range(1, self._size + 1):
+            parent = index + (index & -index)
+            if parent <= self._size:
+                self._tree[parent] += self._tree[index]
+
+    def update(self, telegram_id, count):
+        """Set a user's count, ignored if it isn't higher than the known one"""
+        old = self._counts.get(telegram_id, 0)
+        if count <= old:
+            return
+        if old:
+            group = self._groups[old]
+            del group[telegram_id]
+            if not group:
+                del self._groups[old]
+            self._add(old, -1)
+        self._counts[telegram_id] = count
+        self._groups.setdefault(count, {})[telegram_id] = None
+        if count > self._size:
+            self._build_tree()
+        else:
+            self._add(count, 1)
+
+    def __len__(self):
+        return len(self._counts)
+
+    def rank(self, telegram_id):
+        """``(rank, count)`` of a user, ``(None, 0)`` before their first code
+
+        Users with the same count share a rank.
+        """
+        count = self._counts.get(telegram_id)
+        if count is None:
+            return None, 0
+        return len(self._counts) - self._at_most(count) + 1, count
+
+    def top(self, k):
+        """Up to ``k`` ``(telegram_id, count, rank)`` with the highest counts"""
+        result = []
+        remaining = len(self._counts)  # Users not above the current count
+        while remaining and len(result) < k:
+            count = self._count_at(remaining)
+            group = self._groups[count]
+            rank = len(self._counts) - remaining + 1
+            for telegram_id in group:
+                result.append((telegram_id, count, rank))
+                if len(result) == k:
+                    break
+            remaining -= len(group)
+        return result
+
+    async def _load(self):
+        rows, as_of = await get_redeemed_counts()
+        counts, groups = {}, {}
+        for telegram_id, count in rows:
+            counts[telegram_id] = count
+            groups.setdefault(count, {})[telegram_id] = None
+        # Keep redemptions of this process that happened during the read
+        pending = self._counts
+        self._counts, self._groups = counts, groups
+        self._build_tree()
+        for telegram_id, count in pending.items():
+            self.update(telegram_id, count)
+        self._synced_at = as_of
+        self.loaded = True
+        logging.info(f"Leaderboard loaded with {len(counts)} users")
+
+    async def reconcile(self):
+        """Apply counts changed in the database since the last sync"""
+        since = self._synced_at - timedelta(seconds=self.RECONCILE_OVERLAP)
+        rows, as_of = await get_redeemed_counts(since)
+        for telegram_id, count in rows:
+            self.update(telegram_id, count)
+        self._synced_at = as_of
+
+    async def _run(self):
+        while True:
+            try:
+                if self.loaded:
+                    await self.reconcile()
+                else:
+                    await self._load()
+            except Exception as e:
+                logging.error(f"Leaderboard sync failed: {e}")
+            await asyncio.sleep(self.reconcile_interval)
+
+    async def start(self):
+        """Load the leaderboard in the background and keep it reconciled"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+leaderboard = Leaderboard()
@@ -1,19 +1,49 @@
 import random
 import string
 
-def generate_promocode(length=8):
+# Characters that are easily confused when a printed code is typed in, and
+# the canonical character each one is read as. Lookups compare codes after
+# this mapping. The promocodes.code_norm column is generated with it too;
+# after a change, bump SCHEMA_VERSION in db.py so create_tables rebuilds the
+# column (it compares the column's expression with this mapping)
+CONFUSABLE_CHARS = "OILSBZ"
+CANONICAL_CHARS = "011582"
+_CANONICAL = str.maketrans(CONFUSABLE_CHARS, CANONICAL_CHARS)
+
+# Length of every generated promocode
+PROMOCODE_LENGTH = 8
+
+ALPHABETS = {
+    # Every uppercase letter and digit
+    'full': string.ascii_uppercase + string.digits,
+    # Neither side of a confusable pair, so every code has one spelling
+    'safe': ''.join(
+        c for c in string.ascii_uppercase + string.digits
+        if c not in CONFUSABLE_CHARS + CANONICAL_CHARS
+    ),
+}
+
+def canonicalize_promocode(code):
+    """Map confusable characters of an upper-cased code to their canonical form"""
+    return code.translate(_CANONICAL)
+
+def is_promocode_format(code):
+    """Whether an upper-cased token could be a promocode at all"""
+    return len(code) == PROMOCODE_LENGTH and code.isascii() and code.isalnum()
+
+def generate_promocode(length=PROMOCODE_LENGTH, alphabet='full'):
     """Generate a single random promocode"""
-    # Use only uppercase letters and digits
-    characters = string.ascii_uppercase + string.digits
+    characters = ALPHABETS[alphabet]
     # Ensure the promocode doesn't start with a digit
-    first_char = random.choice(string.ascii_uppercase)
+    first_char = random.choice([c for c in characters if c.isalpha()])
     # Generate the rest of the promocode
     rest_of_code = ''.join(random.choice(characters) for _ in range(length - 1))
     return first_char + rest_of_code
 
-def generate_promocodes(count, length=8):
-    """Generate multiple unique promocodes"""
-    promocodes = set()
+def generate_promocodes(count, length=PROMOCODE_LENGTH, alphabet='full'):
+    """Generate multiple unique promocodes, no two of them confusable"""
+    promocodes = {}
     while len(promocodes) < count:
-        promocodes.add(generate_promocode(length))
-    return list(promocodes)
\ No newline at end of file
+        code = generate_promocode(length, alphabet)
+        promocodes.setdefault(canonicalize_promocode(code), code)
+    return list(promocodes.values())
@@ -0,0 +1,17 @@
+import logging
+import os
+
+
+def mark_ready(path):
+    """Create the readiness file checked by the process supervisor"""
+    if not path:
+        return
+    with open(path, "w") as f:
+        f.write(str(os.getpid()))
+    logging.info(f"Ready: {path}")
+
+
+def clear_ready(path):
+    """Remove the readiness file on shutdown"""
+    if path and os.path.exists(path):
+        os.remove(path)
@@ -0,0 +1,59 @@
+from config_admin import REPORT_CACHE_MAX_ROWS
+
+
+class CachedReport:
+    """Uploaded report documents together with the watermark they were built at"""
+
+    __slots__ = ("watermark", "documents", "rows")
+
+    def __init__(self, watermark, documents, rows):
+        self.watermark = watermark
+        self.documents = documents  # [(file_id, caption), ...]
+        self.rows = rows  # Source records, or None when too large to keep
+
+
+class ReportCache:
+    """In-process cache of generated admin reports
+
+    Reports are keyed by ``(report, campaign_id, format)``. A report whose
+    watermark has not moved is served by re-sending the Telegram file_ids of
+    the previous upload. Source records of reports up to ``max_rows`` rows
+    are kept so that a report can be rebuilt from new rows only.
+    """
+
+    def __init__(self, max_rows=REPORT_CACHE_MAX_ROWS):
+        self.max_rows = max_rows
+        self._reports = {}
+
+    def get(self, key):
+        """Get the cached report for the key, whatever its watermark"""
+        return self._reports.get(key)
+
+    def get_fresh(self, key, watermark):
+        """Get the cached report only if nothing changed since it was built"""
+        report = self._reports.get(key)
+        if report is not None and report.watermark == watermark:
+            return report
+        return None
+
+    def put(self, key, watermark, documents, rows=None):
+        """Store uploaded documents for the key"""
+        if rows is not None and len(rows) > self.max_rows:
+            rows = None
+        self._reports[key] = CachedReport(watermark, documents, rows)
+
+    async def collect(self, records, rows):
+        """Pass records through while copying up to max_rows of them into ``rows``"""
+        if hasattr(records, "__aiter__"):
+            async for record in records:
+                if len(rows) <= self.max_rows:
+                    rows.append(record)
+                yield record
+        else:
+            for record in records:
+                if len(rows) <= self.max_rows:
+                    rows.append(record)
+                yield record
+
+
+report_cache = ReportCache()